@@ -1,46 +1,11 @@
-from swarm import Swarm, Agent
-
-def create_agents():
-    """Create and initialize all agents"""
-    
-    def transfer_to_agent_b(*args, **kwargs):
-        return agent_b
-
-    def transfer_to_agent_d(*args, **kwargs):
-        return agent_d
-        
-    # Create Agent A - The Feature Analyzer
-    agent_a = Agent(
-        name="Agent A",
-        instructions="""You analyze the user's input feature and identify its core purpose.
-
-• Role: Understand and clarify what the user wants in their social proxy
-
-• For each feature input:
-  1. Identify the main functionality
-  2. Understand the user's intent
-  3. Think about how this would affect human interaction
-
-• Format response as:
-  ```
-  FEATURE: [Simple description of the feature]
-  INTENT: [What the user wants to achieve]
-  ```""",
-        functions=[transfer_to_agent_b],
-    )
-
-    # Create Agent B - The Alignment Selector
-    agent_b = Agent(
-        name="Agent B",
-        instructions="""You analyze how user features might face challenges in specific dimensions.
-
-• Input:
-  - User's feature request
-  - Selected dimension to analyze
+import streamlit as st
 
-• These Dimensions Include:
+from swarm import Swarm, Agent
 
-1. Knowledge Schema Alignment
+# Per-dimension knowledge base for Agent B. Only the selected dimension is
+# sent with each request instead of all six definitions.
+DIMENSION_KNOWLEDGE = {
+    "Knowledge Schema Alignment": """Knowledge Schema Alignment
 🔹 Definition:
 This dimension ensures the agent correctly understands and processes relevant knowledge, including user preferences, situational context, and nuanced social cues. 
 It includes learning from past interactions, recognizing emotions, and adapting to different cultures, communication styles, and environments.
@@ -57,8 +22,9 @@ Misinterpreting the emotional state of a conversation participant, leading to in
 Failing to recognize when a conversation is serious vs. lighthearted, resulting in mismatched tone.
 Struggling to adapt to different professional environments, such as corporate meetings vs. casual brainstorming sessions.
 Not accounting for implicit social expectations, such as knowing when silence indicates discomfort vs. thoughtfulness.
+""",
 
-2. Autonomy & Agency Alignment
+    "Autonomy & Agency Alignment": """Autonomy & Agency Alignment
 Balancing independent decision-making with user expectations
 
 🔹 Definition:
@@ -79,9 +45,9 @@ Interrupting a meeting at an inappropriate moment, disrupting the flow of conver
 Failing to act when urgent intervention is needed (e.g., when a misunderstanding arises).
 Overriding user preferences without consulting them, leading to frustration.
 Taking unnecessary actions that make the user feel a loss of control.
+""",
 
-
-3. Operational Alignment
+    "Operational Alignment": """Operational Alignment
  Ensuring smooth physical and technical execution
 
 🔹 Definition:
@@ -101,8 +67,9 @@ Delayed or awkward pauses in speech leading to unnatural conversation flow.
 Making mechanical or exaggerated gestures that do not match the conversation tone.
 Failing to adjust voice pitch and volume based on context (e.g., speaking too loudly in a quiet room).
 Moving too abruptly or failing to maintain appropriate body positioning in interactions.
+""",
 
-4. Reputational Alignment
+    "Reputational Alignment": """Reputational Alignment
  Maintaining and protecting the user's professional and social image
 
 🔹 Definition:
@@ -121,8 +88,9 @@ Being too informal in a high-stakes professional meeting, affecting credibility.
 Agreeing to something on the user's behalf that they would not have accepted.
 Mishandling a disagreement in a way that causes social tension or offense.
 Creating a perception that the user is inattentive or unprofessional due to robotic speech patterns.
+""",
 
-5. Ethics Alignment
+    "Ethics Alignment": """Ethics Alignment
  Ensuring moral responsibility and safe decision-making
 
 🔹 Definition:
@@ -141,8 +109,9 @@ Deciding whether to disclose private information in a sensitive conversation.
 Struggling to balance transparency with discretion in ethical dilemmas.
 Being manipulated by other users into revealing confidential details.
 Prioritizing efficiency over fairness (e.g., giving preference to one user unfairly).
+""",
 
-6. Human Engagement Alignment
+    "Human Engagement Alignment": """Human Engagement Alignment
 Ensuring appropriate interaction levels between the agent and the user
 
 🔹 Definition:
@@ -161,7 +130,56 @@ Over-notifying the user about minor issues, causing frustration.
 Not consulting the user on major decisions, leading to unexpected outcomes.
 Interrupting at inconvenient times instead of waiting for an appropriate moment.
 Providing unclear or excessive feedback that overwhelms the user.
+""",
+}
+
+@st.cache_resource
+def create_agents():
+    """Create and initialize all agents.
+    
+    Agents are shared by every session, so their prompts are assembled once per process.
+    """
+    
+    def transfer_to_agent_b(*args, **kwargs):
+        """Hand the analyzed feature to Agent B to find challenges for the selected dimension"""
+        return agent_b
+
+    def transfer_to_agent_d(*args, **kwargs):
+        """Hand the challenge information to Agent D to write the next story chapter"""
+        return agent_d
+        
+    # Create Agent A - The Feature Analyzer
+    agent_a = Agent(
+        name="Agent A",
+        instructions="""You analyze the user's input feature and identify its core purpose.
+
+• Role: Understand and clarify what the user wants in their social proxy
+
+• For each feature input:
+  1. Identify the main functionality
+  2. Understand the user's intent
+  3. Think about how this would affect human interaction
+
+• Format response as:
+  ```
+  FEATURE: [Simple description of the feature]
+  INTENT: [What the user wants to achieve]
+  ```""",
+        functions=[transfer_to_agent_b],
+    )
+
+    # Create Agent B - The Alignment Selector
+    agent_b = Agent(
+        name="Agent B",
+        instructions="""You analyze how user features might face challenges in specific dimensions.
+
+• Input:
+  - User's feature request
+  - Selected dimension to analyze
+
+• Selected Dimension Knowledge Base:
 
+{knowledge}
 
 • Your Task:
   1. Read the user's feature
@@ -188,6 +206,7 @@ Providing unclear or excessive feedback that overwhelms the user.
   • [Challenge described in natural terms without technical jargon]
   • [Challenge described as a realistic scenario without revealing the dimension]
   ```""",
+        knowledge=DIMENSION_KNOWLEDGE,
     )
 
     # Create Agent D - The Storyteller
@@ -0,0 +1,175 @@
+"""Precomputed study analytics, materialized into summary collections.
+
+Everything is computed server-side with aggregation pipelines and written
+with `$merge`, so dashboards read a handful of small documents:
+
+- `analytics_chapters`: one document per (session_id, chapter_number), with
+  its dimension, prompt length and feature rank. Only chapters saved or ranked
+  since the last refresh are recomputed.
+- `analytics_dimensions`: one document per alignment dimension, with features
+  per chapter, prompt lengths, ranking distribution and completion rate.
+  Only dimensions touched by the refresh are rolled up again.
+
+    python analytics.py            # incremental refresh
+    python analytics.py --full     # recompute everything
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+from db import DATABASE_NAME, mongo_uri
+
+STATE_COLLECTION = "analytics_state"
+
+# Saves are stamped before they reach MongoDB, so look back a little past the
+# newest processed save; $merge replaces by key, making the overlap harmless
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+def _changed_since(since):
+    if not since:
+        return []
+    # ISO timestamps compare correctly as strings
+    return [{'$match': {'$or': [
+        {'timestamp': {'$gte': since}},
+        {'rankings_timestamp': {'$gte': since}}
+    ]}}]
+
+def _newest_saved(db, since):
+    """Get the newest save or ranking timestamp among the chapters a refresh will process"""
+    result = list(db.sessions.aggregate(_changed_since(since) + [
+        {'$group': {
+            '_id': None,
+            'timestamp': {'$max': '$timestamp'},
+            'rankings_timestamp': {'$max': '$rankings_timestamp'}
+        }}
+    ]))
+    if not result:
+        return None
+    return max(filter(None, [result[0].get('timestamp'), result[0].get('rankings_timestamp')]), default=None)
+
+def _chapter_pipeline(since, refreshed_at):
+    pipeline = _changed_since(since)
+    pipeline += [
+        # Rank this chapter's feature in the session's latest ranking submission
+        {'$lookup': {
+            'from': 'feature_rankings',
+            'localField': 'session_id',
+            'foreignField': 'session_id',
+            'let': {'feature': '$prompt'},
+            'pipeline': [
+                {'$sort': {'timestamp': -1}},
+                {'$limit': 1},
+                {'$unwind': '$rankings'},
+                {'$match': {'$expr': {'$eq': ['$rankings.feature', '$$feature']}}},
+                {'$project': {'_id': 0, 'rank': '$rankings.rank'}}
+            ],
+            'as': 'ranking'
+        }},
+        {'$project': {
+            '_id': {'session_id': '$session_id', 'chapter_number': '$chapter_number'},
+            'session_id': 1,
+            'chapter_number': 1,
+            'alignment_dimension': 1,
+            'has_feature': {'$cond': [{'$gt': [{'$strLenCP': {'$ifNull': ['$prompt', '']}}, 0]}, 1, 0]},
+            'prompt_length': {'$strLenCP': {'$ifNull': ['$prompt', '']}},
+            'rank': {'$first': '$ranking.rank'},
+            'rankings_completed': {'$ifNull': ['$rankings_completed', False]},
+            'saved_at': '$timestamp',
+            'refreshed_at': {'$literal': refreshed_at}
+        }},
+        {'$merge': {'into': 'analytics_chapters', 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+    ]
+    return pipeline
+
+def _dimension_pipeline(dimensions, refreshed_at):
+    return [
+        {'$match': {'alignment_dimension': {'$in': dimensions}}},
+        # Per session first, so completion is counted once per participant
+        {'$group': {
+            '_id': {'dimension': '$alignment_dimension', 'session_id': '$session_id'},
+            'chapters': {'$sum': 1},
+            'features': {'$sum': '$has_feature'},
+            'prompt_length': {'$sum': '$prompt_length'},
+            'max_prompt_length': {'$max': '$prompt_length'},
+            'completed': {'$max': {'$cond': ['$rankings_completed', 1, 0]}}
+        }},
+        {'$group': {
+            '_id': '$_id.dimension',
+            'sessions': {'$sum': 1},
+            'completed_sessions': {'$sum': '$completed'},
+            'chapters': {'$sum': '$chapters'},
+            'features': {'$sum': '$features'},
+            'prompt_length': {'$sum': '$prompt_length'},
+            'max_prompt_length': {'$max': '$max_prompt_length'}
+        }},
+        {'$project': {
+            'sessions': 1,
+            'completed_sessions': 1,
+            'chapters': 1,
+            'features': 1,
+            'max_prompt_length': 1,
+            'features_per_chapter': {'$divide': ['$features', '$chapters']},
+            'avg_prompt_length': {'$divide': ['$prompt_length', '$chapters']},
+            'completion_rate': {'$divide': ['$completed_sessions', '$sessions']},
+            'rank_distribution': {'$literal': []},
+            'refreshed_at': {'$literal': refreshed_at}
+        }},
+        {'$merge': {'into': 'analytics_dimensions', 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+    ]
+
+def _rank_pipeline(dimensions):
+    return [
+        {'$match': {'alignment_dimension': {'$in': dimensions}, 'rank': {'$ne': None}}},
+        {'$group': {'_id': {'dimension': '$alignment_dimension', 'rank': '$rank'}, 'count': {'$sum': 1}}},
+        {'$sort': {'_id.rank': 1}},
+        {'$group': {'_id': '$_id.dimension', 'rank_distribution': {'$push': {'rank': '$_id.rank', 'count': '$count'}}}},
+        {'$merge': {'into': 'analytics_dimensions', 'on': '_id', 'whenMatched': 'merge', 'whenNotMatched': 'discard'}}
+    ]
+
+def refresh(db, full=False):
+    """Bring the summary collections up to date; returns the dimensions rolled up"""
+    state = db[STATE_COLLECTION].find_one({'_id': 'chapters'}) or {}
+    since = None if full else state.get('watermark')
+    refreshed_at = datetime.now().isoformat()
+
+    db.analytics_chapters.create_index('refreshed_at')
+    db.analytics_chapters.create_index('alignment_dimension')
+
+    # Read the watermark from the data before merging: anything saved meanwhile
+    # is at or past it and gets picked up by the next refresh
+    newest = _newest_saved(db, since)
+    db.sessions.aggregate(_chapter_pipeline(since, refreshed_at))
+    dimensions = [d for d in db.analytics_chapters.distinct('alignment_dimension', {'refreshed_at': refreshed_at}) if d]
+    if dimensions:
+        db.analytics_chapters.aggregate(_dimension_pipeline(dimensions, refreshed_at))
+        db.analytics_chapters.aggregate(_rank_pipeline(dimensions))
+
+    # Keep the old watermark when nothing was processed
+    watermark = (datetime.fromisoformat(newest) - WATERMARK_OVERLAP).isoformat() if newest else state.get('watermark')
+    db[STATE_COLLECTION].update_one(
+        {'_id': 'chapters'},
+        {'$set': {'watermark': watermark, 'refreshed_at': refreshed_at}},
+        upsert=True
+    )
+    return dimensions
+
+def dimension_summary(db):
+    """Get the precomputed per-dimension stats, keyed by dimension"""
+    return {doc.pop('_id'): doc for doc in db.analytics_dimensions.find()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the precomputed study analytics")
+    parser.add_argument("--mongo-uri", help="MongoDB connection string")
+    parser.add_argument("--full", action="store_true", help="recompute every chapter instead of only new ones")
+    args = parser.parse_args()
+
+    db = MongoClient(mongo_uri(args.mongo_uri))[DATABASE_NAME]
+    dimensions = refresh(db, args.full)
+    print(f"Refreshed {len(dimensions)} dimensions")
+    for dimension, stats in dimension_summary(db).items():
+        print(f"{dimension}: {stats['sessions']} sessions, {stats['features_per_chapter']:.2f} features/chapter, "
+              f"completion {stats['completion_rate']:.0%}")
+
+if __name__ == "__main__":
+    main()
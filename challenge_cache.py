@@ -0,0 +1,86 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+class ChallengeCache:
+    """Shared pool of Agent B challenge responses keyed by dimension.
+
+    Each dimension keeps up to `variants_per_dimension` responses so stories
+    still differ between participants. Variants expire after `ttl` seconds and
+    the least recently used dimension is evicted once `max_dimensions` is hit.
+    """
+
+    def __init__(self, variants_per_dimension=3, ttl=3600, max_dimensions=16):
+        self.variants_per_dimension = variants_per_dimension
+        self.ttl = ttl
+        self.max_dimensions = max_dimensions
+        self._entries = OrderedDict()  # dimension -> [(created_at, challenge), ...]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _fresh_variants(self, dimension):
+        """Drop expired variants for a dimension and return what is left"""
+        cutoff = time.monotonic() - self.ttl
+        variants = [v for v in self._entries.get(dimension, []) if v[0] >= cutoff]
+        if variants:
+            self._entries[dimension] = variants
+        else:
+            self._entries.pop(dimension, None)
+        return variants
+
+    def get(self, dimension):
+        """Return a cached challenge, or None while the dimension's pool is not full yet"""
+        with self._lock:
+            variants = self._fresh_variants(dimension)
+            if len(variants) >= self.variants_per_dimension:
+                self._entries.move_to_end(dimension)
+                self.hits += 1
+                return random.choice(variants)[1]
+            self.misses += 1
+            return None
+
+    def put(self, dimension, challenge):
+        """Add a freshly generated challenge to the dimension's pool"""
+        with self._lock:
+            variants = self._fresh_variants(dimension)
+            variants.append((time.monotonic(), challenge))
+            # Keep only the newest variants if concurrent misses overfilled the pool
+            self._entries[dimension] = variants[-self.variants_per_dimension:]
+            self._entries.move_to_end(dimension)
+            while len(self._entries) > self.max_dimensions:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_generate(self, dimension, generate):
+        """Return a cached challenge or call `generate()` and cache its result"""
+        challenge = self.get(dimension)
+        if challenge is None:
+            challenge = generate()
+            self.put(dimension, challenge)
+        return challenge
+
+    def stats(self):
+        """Get hit/miss counters and current pool sizes"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'variants': {d: len(v) for d, v in self._entries.items()}
+            }
+
+@st.cache_resource
+def get_challenge_cache():
+    """Get the process-wide challenge cache shared by every session"""
+    return ChallengeCache(
+        variants_per_dimension=int(st.secrets.get("challenge_cache_variants", 3)),
+        ttl=float(st.secrets.get("challenge_cache_ttl", 3600)),
+        max_dimensions=int(st.secrets.get("challenge_cache_max_dimensions", 16)),
+    )
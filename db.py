@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+
+import streamlit as st
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+DATABASE_NAME = "surrogate_stories"
+
+# Indexes backing StoryManager's and the analytics refresh's queries, by
+# collection. Not unique, since sessions written before save_session()
+# upserted may hold duplicate chapters.
+INDEXES = {
+    'stories': [
+        [('session_id', ASCENDING), ('timestamp', ASCENDING)],
+        [('session_id', ASCENDING), ('chapter_number', ASCENDING)],
+    ],
+    'prompts': [[('session_id', ASCENDING), ('timestamp', ASCENDING)]],
+    'parameters': [[('session_id', ASCENDING), ('timestamp', ASCENDING)]],
+    'challenges': [[('session_id', ASCENDING), ('timestamp', ASCENDING)]],
+    'sessions': [
+        [('session_id', ASCENDING), ('chapter_number', ASCENDING)],
+        [('timestamp', ASCENDING)],
+        [('rankings_timestamp', ASCENDING)],
+    ],
+    'feature_rankings': [[('session_id', ASCENDING)]],
+}
+
+def warm_up(client):
+    """Finish topology discovery and open a first pooled connection"""
+    # For mongodb+srv:// URIs the SRV/TXT records are resolved when the client
+    # is constructed; the ping waits for server selection and TLS so the first
+    # participant write doesn't pay for them. The background pool maintainer
+    # then tops the pool up to minPoolSize.
+    start = time.perf_counter()
+    try:
+        client.admin.command("ping")
+        print(f"MongoDB warm-up finished in {(time.perf_counter() - start) * 1000:.0f} ms")
+    except Exception as e:
+        print(f"MongoDB warm-up failed: {str(e)}")
+
+def mongo_uri(explicit=None):
+    """Resolve the MongoDB URI for command-line tools.
+
+    Order: an explicit value, MONGO_URI from the environment (.env is
+    loaded), then `mongo_uri` from .streamlit/secrets.toml.
+    """
+    if explicit:
+        return explicit
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.environ.get("MONGO_URI") or st.secrets["mongo_uri"]
+
+@st.cache_resource
+def get_mongo_client():
+    """Create the process-wide MongoClient that every StoryManager borrows"""
+    client = MongoClient(
+        st.secrets["mongo_uri"],
+        maxPoolSize=int(st.secrets.get("mongo_max_pool_size", 50)),
+        minPoolSize=int(st.secrets.get("mongo_min_pool_size", 5)),
+        maxIdleTimeMS=int(st.secrets.get("mongo_max_idle_time_ms", 300000)),
+        serverSelectionTimeoutMS=int(st.secrets.get("mongo_server_selection_timeout_ms", 10000)),
+        appname="surrogate-stories",
+    )
+    warm_up(client)
+    return client
+
+def ensure_indexes(db):
+    """Create any missing indexes; safe to call repeatedly.
+
+    Returns False at the first connection failure rather than waiting out
+    server selection once per index, so the caller can retry later.
+    """
+    for collection, indexes in INDEXES.items():
+        for keys in indexes:
+            try:
+                # create_index is a no-op when an identical index already exists
+                db[collection].create_index(keys)
+            except ConnectionFailure as e:
+                print(f"Could not ensure indexes, MongoDB unreachable: {str(e)}")
+                return False
+            except Exception as e:
+                print(f"Could not ensure index {keys} on {collection}: {str(e)}")
+    return True
+
+def _ensure_indexes_until_done(db, retry_delay, max_delay):
+    # Keep trying while MongoDB is unreachable, backing off up to max_delay
+    while not ensure_indexes(db):
+        time.sleep(retry_delay)
+        retry_delay = min(retry_delay * 2, max_delay)
+
+@st.cache_resource
+def ensure_database_ready():
+    """Ensure the study indexes once per process, in the background.
+
+    Runs off the script thread so the first participant never waits on
+    index builds or an unreachable server; retries until MongoDB answers.
+    """
+    db = get_database()
+    threading.Thread(
+        target=_ensure_indexes_until_done,
+        args=(db, float(st.secrets.get("index_retry_delay", 5)), float(st.secrets.get("index_retry_max_delay", 300))),
+        name="mongo-ensure-indexes",
+        daemon=True
+    ).start()
+    return True
+
+def index_report(db, slow_ms=None):
+    """Summarize index usage and slow queries for the study collections.
+    
+    Index usage comes from $indexStats. Slow-query stats need the database
+    profiler to be enabled (profiling level 1 or 2); otherwise they are empty.
+    """
+    report = {'indexes': {}, 'slow_queries': [], 'profiling_level': None}
+    for collection in INDEXES:
+        try:
+            report['indexes'][collection] = [
+                {'name': stat['name'], 'ops': stat['accesses']['ops'], 'since': stat['accesses']['since']}
+                for stat in db[collection].aggregate([{'$indexStats': {}}])
+            ]
+        except OperationFailure as e:
+            report['indexes'][collection] = f"unavailable: {str(e)}"
+    
+    try:
+        profile = db.command('profile', -1)
+        report['profiling_level'] = profile.get('was')
+        threshold = slow_ms if slow_ms is not None else profile.get('slowms', 100)
+        report['slow_queries'] = list(db['system.profile'].aggregate([
+            {'$match': {'millis': {'$gte': threshold}}},
+            {'$group': {
+                '_id': {'ns': '$ns', 'op': '$op', 'plan': '$planSummary'},
+                'count': {'$sum': 1},
+                'avg_ms': {'$avg': '$millis'},
+                'max_ms': {'$max': '$millis'},
+                'docs_examined': {'$sum': '$docsExamined'}
+            }},
+            {'$sort': {'count': -1}}
+        ]))
+    except OperationFailure as e:
+        # Managed clusters may not expose the profiler
+        report['slow_queries'] = f"unavailable: {str(e)}"
+    return report
+
+def get_database():
+    """Get the study database on the shared client"""
+    return get_mongo_client()[DATABASE_NAME]
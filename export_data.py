@@ -0,0 +1,341 @@
+"""Export study data from MongoDB to chunked Parquet and CSV files.
+
+Cursors are streamed in batches and written chunk by chunk, so memory stays
+bounded by the batch size rather than the size of the study.
+
+    python export_data.py export --out exports
+    python export_data.py export --out exports --since-last --format parquet
+    python export_data.py benchmark --mongo-uri mongodb://localhost:27017 --sessions 2000
+
+The MongoDB URI comes from --mongo-uri, the MONGO_URI environment variable
+(.env is loaded) or `mongo_uri` in .streamlit/secrets.toml.
+
+--since-last picks up rows saved, ranked or revised since the previous run,
+looking back --overlap-minutes past its watermark for writes that reached
+MongoDB late (e.g. replayed from the app's local journal). A row can
+therefore appear in more than one run's files; dedupe on (session_id,
+chapter_number) for chapters, (id, feature) for feature_rankings and `id`
+for the other tables, keeping the row from the latest run.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pymongo import MongoClient
+
+from db import DATABASE_NAME, ensure_indexes, mongo_uri
+from ids import new_session_id
+
+STATE_FILE = "export_state.json"
+
+# Default look-back past the last watermark; widen it after a long MongoDB
+# outage, since journaled writes keep the timestamp they were made at
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+def _chapter_rows(db, batch):
+    """Join a batch of chapter rows with their feature rankings by session_id"""
+    session_ids = list({doc['session_id'] for doc in batch})
+    ranks = {}
+    # Later ranking submissions (retries) overwrite earlier ones
+    for ranking in db.feature_rankings.find(
+        {'session_id': {'$in': session_ids}},
+        {'_id': 0, 'session_id': 1, 'rankings': 1}
+    ).sort('timestamp', 1):
+        ranks[ranking['session_id']] = {item['feature']: item['rank'] for item in ranking.get('rankings', [])}
+    return [
+        {
+            'session_id': doc['session_id'],
+            'prolific_id': doc.get('prolific_id'),
+            'chapter_number': doc.get('chapter_number'),
+            'alignment_dimension': doc.get('alignment_dimension'),
+            'prompt': doc.get('prompt'),
+            'story': doc.get('story'),
+            'feature_rank': ranks.get(doc['session_id'], {}).get(doc.get('prompt')),
+            'rankings_completed': bool(doc.get('rankings_completed', False)),
+            'timestamp': doc.get('timestamp')
+        }
+        for doc in batch
+    ]
+
+def _ranking_rows(db, batch):
+    """Flatten each ranking submission into one row per ranked feature"""
+    return [
+        {
+            'id': str(doc['_id']),
+            'session_id': doc['session_id'],
+            'prolific_id': doc.get('prolific_id'),
+            'feature': item['feature'],
+            'rank': item['rank'],
+            'timestamp': doc.get('timestamp')
+        }
+        for doc in batch
+        for item in doc.get('rankings', [])
+    ]
+
+def _plain_rows(field):
+    def rows(db, batch):
+        return [
+            {
+                'id': str(doc['_id']),
+                'session_id': doc['session_id'],
+                'prolific_id': doc.get('prolific_id'),
+                field: doc.get(field),
+                'timestamp': doc.get('timestamp')
+            }
+            for doc in batch
+        ]
+    return rows
+
+def _plain_schema(field):
+    return pa.schema([
+        ('id', pa.string()),
+        ('session_id', pa.string()),
+        ('prolific_id', pa.string()),
+        (field, pa.string()),
+        ('timestamp', pa.string())
+    ])
+
+# Exported tables: source collection, index-backed sort order, the fields
+# stamped when a row changes, output schema and row builder
+TABLES = {
+    'chapters': {
+        'collection': 'sessions',
+        'sort': [('session_id', 1), ('chapter_number', 1)],
+        # Ranking a session re-stamps its chapters' feature_rank/rankings_completed
+        'changed': ['timestamp', 'rankings_timestamp'],
+        'schema': pa.schema([
+            ('session_id', pa.string()),
+            ('prolific_id', pa.string()),
+            ('chapter_number', pa.int64()),
+            ('alignment_dimension', pa.string()),
+            ('prompt', pa.string()),
+            ('story', pa.string()),
+            ('feature_rank', pa.int64()),
+            ('rankings_completed', pa.bool_()),
+            ('timestamp', pa.string())
+        ]),
+        'rows': _chapter_rows
+    },
+    'stories': {
+        'collection': 'stories',
+        'sort': [('session_id', 1), ('timestamp', 1)],
+        # Revised chapters keep their timestamp and get edited_at
+        'changed': ['timestamp', 'edited_at'],
+        'schema': _plain_schema('segment'),
+        'rows': _plain_rows('segment')
+    },
+    'prompts': {
+        'collection': 'prompts',
+        'sort': [('session_id', 1), ('timestamp', 1)],
+        'changed': ['timestamp'],
+        'schema': _plain_schema('prompt'),
+        'rows': _plain_rows('prompt')
+    },
+    'parameters': {
+        'collection': 'parameters',
+        'sort': [('session_id', 1), ('timestamp', 1)],
+        'changed': ['timestamp'],
+        'schema': _plain_schema('parameter'),
+        'rows': _plain_rows('parameter')
+    },
+    'challenges': {
+        'collection': 'challenges',
+        'sort': [('session_id', 1), ('timestamp', 1)],
+        'changed': ['timestamp'],
+        'schema': _plain_schema('challenge'),
+        'rows': _plain_rows('challenge')
+    },
+    'feature_rankings': {
+        'collection': 'feature_rankings',
+        'sort': [('session_id', 1), ('timestamp', 1)],
+        'changed': ['timestamp'],
+        'schema': pa.schema([
+            ('id', pa.string()),
+            ('session_id', pa.string()),
+            ('prolific_id', pa.string()),
+            ('feature', pa.string()),
+            ('rank', pa.int64()),
+            ('timestamp', pa.string())
+        ]),
+        'rows': _ranking_rows
+    }
+}
+
+class ChunkWriter:
+    """Append row chunks of one table to a Parquet and/or CSV file"""
+
+    def __init__(self, path_base, schema, formats):
+        self.path_base = path_base
+        self.schema = schema
+        self.formats = formats
+        self._parquet = None
+        self._csv_started = False
+
+    def write(self, rows):
+        frame = pd.DataFrame.from_records(rows, columns=self.schema.names)
+        if 'parquet' in self.formats:
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(f"{self.path_base}.parquet", self.schema)
+            # Each chunk becomes one row group
+            self._parquet.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+        if 'csv' in self.formats:
+            frame.to_csv(f"{self.path_base}.csv", mode='a', header=not self._csv_started, index=False)
+            self._csv_started = True
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+def _batches(cursor, size):
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def export_table(db, name, out_dir, run_id, formats, since=None, batch_size=1000, overlap=WATERMARK_OVERLAP):
+    """Stream one table to disk; returns (rows written, newest change timestamp seen)"""
+    spec = TABLES[name]
+    query = {}
+    if since:
+        # ISO timestamps compare correctly as strings
+        start = (datetime.fromisoformat(since) - overlap).isoformat()
+        query = {'$or': [{field: {'$gte': start}} for field in spec['changed']]}
+    cursor = db[spec['collection']].find(query).sort(spec['sort']).batch_size(batch_size)
+
+    writer = None
+    written = 0
+    watermark = since
+    try:
+        for batch in _batches(cursor, batch_size):
+            newest = max((doc.get(field) or '') for doc in batch for field in spec['changed'])
+            watermark = max(watermark or '', newest) or None
+            rows = spec['rows'](db, batch)
+            if not rows:
+                continue
+            if writer is None:
+                writer = ChunkWriter(os.path.join(out_dir, f"{name}-{run_id}"), spec['schema'], formats)
+            writer.write(rows)
+            written += len(rows)
+    finally:
+        cursor.close()
+        if writer is not None:
+            writer.close()
+    return written, watermark
+
+def _load_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def export(db, out_dir, tables=None, formats=("parquet", "csv"), since_last=False, batch_size=1000,
+           overlap=WATERMARK_OVERLAP):
+    """Export the selected tables and record per-table watermarks for incremental runs"""
+    os.makedirs(out_dir, exist_ok=True)
+    state = _load_state(out_dir)
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+    summary = {}
+    for name in tables or TABLES:
+        since = state.get(name) if since_last else None
+        written, watermark = export_table(db, name, out_dir, run_id, formats, since, batch_size, overlap)
+        summary[name] = written
+        if watermark:
+            state[name] = watermark
+        print(f"{name}: {written} rows")
+    _save_state(out_dir, state)
+    return summary
+
+def _seed_benchmark_data(db, sessions, chapters):
+    """Fill a scratch database with synthetic sessions shaped like the real ones"""
+    dimensions = ["Knowledge Schema Alignment", "Autonomy & Agency Alignment", "Operational Alignment",
+                  "Reputational Alignment", "Ethics Alignment", "Human Engagement Alignment"]
+    start = datetime(2025, 1, 1)
+    for _ in range(sessions):
+        session_id = new_session_id()
+        prompts = [f"Add feature {i} because reason {random.random()}" for i in range(chapters)]
+        stamps = [(start + timedelta(seconds=random.randint(0, 10 ** 7))).isoformat() for _ in range(chapters)]
+        base = {'session_id': session_id, 'prolific_id': f"P{random.randint(0, 10 ** 6)}"}
+        db.stories.insert_many([{**base, 'timestamp': t, 'segment': "lorem ipsum " * 40} for t in stamps])
+        db.prompts.insert_many([{**base, 'timestamp': t, 'prompt': p} for t, p in zip(stamps, prompts)])
+        db.sessions.insert_many([
+            {**base, 'chapter_number': i + 1, 'prompt': p, 'story': "lorem ipsum " * 40,
+             'alignment_dimension': dimensions[i % len(dimensions)], 'timestamp': t}
+            for i, (t, p) in enumerate(zip(stamps, prompts))
+        ])
+        db.feature_rankings.insert_one({
+            **base, 'timestamp': stamps[-1], 'total_features': chapters,
+            'rankings': [{'feature': p, 'rank': i + 1, 'chapter_number': i + 1} for i, p in enumerate(prompts)]
+        })
+
+def benchmark(client, sessions, chapters, batch_size, formats, keep=False):
+    """Measure export throughput against a scratch database on a local MongoDB"""
+    db = client[f"{DATABASE_NAME}_export_bench"]
+    client.drop_database(db.name)
+    out_dir = tempfile.mkdtemp(prefix="export-bench-")
+    try:
+        print(f"Seeding {sessions} sessions x {chapters} chapters...")
+        _seed_benchmark_data(db, sessions, chapters)
+        ensure_indexes(db)
+
+        start = time.perf_counter()
+        summary = export(db, out_dir, formats=formats, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        rows = sum(summary.values())
+        # ru_maxrss is reported in kilobytes on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"Exported {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s), peak RSS {peak_mb:.0f} MB")
+        return {'rows': rows, 'seconds': elapsed, 'rows_per_second': rows / elapsed, 'peak_rss_mb': peak_mb}
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        if not keep:
+            client.drop_database(db.name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export study data to Parquet/CSV")
+    parser.add_argument("--mongo-uri", help="MongoDB connection string")
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents per cursor batch and output chunk")
+    parser.add_argument("--format", nargs="+", choices=["parquet", "csv"], default=["parquet", "csv"])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="export study data")
+    export_parser.add_argument("--out", default="exports", help="output directory")
+    export_parser.add_argument("--tables", nargs="+", choices=list(TABLES), help="tables to export (default: all)")
+    export_parser.add_argument("--since-last", action="store_true", help="only export rows changed since the last run")
+    export_parser.add_argument("--overlap-minutes", type=float, default=WATERMARK_OVERLAP.total_seconds() / 60,
+                               help="with --since-last, how far to look back past the last run's watermark")
+
+    bench_parser = commands.add_parser("benchmark", help="measure export throughput on a local MongoDB")
+    bench_parser.add_argument("--sessions", type=int, default=1000)
+    bench_parser.add_argument("--chapters", type=int, default=6)
+    bench_parser.add_argument("--keep", action="store_true", help="keep the seeded benchmark database")
+
+    args = parser.parse_args()
+    client = MongoClient(mongo_uri(args.mongo_uri))
+    if args.command == "export":
+        export(client[DATABASE_NAME], args.out, args.tables, args.format, args.since_last, args.batch_size,
+               timedelta(minutes=args.overlap_minutes))
+    else:
+        benchmark(client, args.sessions, args.chapters, args.batch_size, args.format, args.keep)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from story_generation import StoryStreamParser, parse_story
+
+class GenerationJob:
+    """State of one background chapter generation, polled by the UI.
+
+    The worker thread writes progress, the streamed story and the outcome
+    here; the Streamlit script only reads it, so no widget is ever touched
+    off the script thread.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.fraction = 0.0
+        self.status = "Queued..."
+        self.story_so_far = None
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self._parser = StoryStreamParser()
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def on_pipeline_event(self, event):
+        if event.kind == 'delta':
+            self.story_so_far = self._parser.feed(event.data)
+            return
+        if event.kind == 'retry' and event.step == 'story':
+            self._parser = StoryStreamParser()
+            self.story_so_far = None
+        # The pipeline fills the bar up to 95%; saving the story completes it
+        self.fraction = max(self.fraction, 0.95 * event.progress)
+        self.status = event.status or self.status
+
+    def on_store_event(self, event):
+        if event.kind == 'persisted' and event.source == 'stories':
+            self.fraction = 1.0
+            self.status = "Story saved"
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+def request_key(session_id, chapter, user_input):
+    """Dedup key for a generation request: identical input for the same chapter is the same request"""
+    digest = hashlib.sha256(user_input.strip().encode("utf-8")).hexdigest()
+    return (session_id, chapter, digest)
+
+class GenerationExecutor:
+    """Thread pool running chapter generations, deduplicated by request key.
+
+    Requests are single-flighted: submitting a key whose job is still running
+    joins that job, and submitting one whose job succeeded returns the cached
+    result, so a double click or rerun never bills a second completion or
+    writes the chapter twice. Failed jobs are replaced by a fresh attempt.
+    Finished jobs are kept for `retention` seconds.
+    """
+
+    def __init__(self, max_workers=100, retention=600):
+        self.retention = retention
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chapter-generation")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+        self.cached = 0
+
+    def submit(self, key, work):
+        """Run `work(job)` in the background unless the request is in flight or done; returns its job"""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(key)
+            if job is not None and not job.done:
+                self.joined += 1
+                return job
+            if job is not None and job.error is None:
+                self.cached += 1
+                return job
+            job = GenerationJob(key)
+            self._jobs[key] = job
+            self.started += 1
+        self._pool.submit(self._run, job, work)
+        return job
+
+    def _run(self, job, work):
+        try:
+            job.finish(result=work(job))
+        except Exception as e:
+            print(f"Chapter generation {job.key} failed: {e!r}")
+            job.finish(error=e)
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def discard(self, key):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'jobs': len(self._jobs),
+                'started': self.started,
+                'joined': self.joined,
+                'cached': self.cached
+            }
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention
+        for key in [k for k, job in self._jobs.items() if job.done and job.finished_at < cutoff]:
+            del self._jobs[key]
+
+def generate_chapter(job, swarm, pipeline, story_manager, prefetcher, user_input, chapter, dimension, revise,
+                     challenge_timeout=None):
+    """Background work for one chapter: run the pipeline, then record the story in the StoryManager.
+
+    `pipeline` is built by the caller on the script thread, since building it
+    reads secrets and the cached challenge store.
+    `revise` rewrites an earlier chapter instead of appending a new one.
+    The prompt, parameter and challenge are recorded only once a valid story
+    is back, so a failed attempt and its retry never store them twice.
+    """
+    # Use the challenge prefetched while the participant was typing, if any
+    challenge = prefetcher.take(chapter, dimension, timeout=challenge_timeout)
+
+    # Analyze the feature (Agent A) while getting dimension information (Agent B),
+    # then stream the story (Agent D)
+    result = pipeline.run(
+        swarm,
+        {'user_input': user_input, 'dimension': dimension, 'challenge': challenge},
+        job.on_pipeline_event
+    )
+    story_text = parse_story(result['story'])
+    if not story_text:
+        raise ValueError(f"Failed to generate a valid story. Response received: {result['story']}")
+
+    story_manager.add_user_prompt(user_input)
+    story_manager.add_parameter(dimension)
+    story_manager.add_challenge(result['challenge'])
+
+    unsubscribe = story_manager.events.subscribe(job.on_store_event)
+    try:
+        if revise:
+            story_manager.update_chapter_story(chapter, story_text)
+        else:
+            story_manager.current_story = story_text
+            story_manager.add_story_segment(result['story'])
+            story_manager.add_covered_dimension(chapter)
+    finally:
+        unsubscribe()
+    return {'chapter': chapter, 'story': story_text, 'revised': revise}
+
+@st.cache_resource
+def get_generation_executor():
+    """Get the process-wide chapter generation pool shared by every session"""
+    # A job holds its thread while it waits on OpenAI, so by default allow as
+    # many jobs as the shared OpenAI connection pool can serve; a smaller
+    # pool would queue clicks that used to generate in parallel
+    max_workers = st.secrets.get("generation_workers") or st.secrets.get("openai_max_connections", 100)
+    return GenerationExecutor(
+        max_workers=int(max_workers),
+        retention=float(st.secrets.get("generation_job_retention", 600)),
+    )
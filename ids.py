@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# Crockford base32, as used by ULID
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+LEGACY_FORMAT = "%Y%m%d_%H%M%S"
+
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(ALPHABET[index])
+    return "".join(reversed(chars))
+
+def _decode(text):
+    value = 0
+    for char in text.upper():
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+class ULIDGenerator:
+    """Monotonic ULID generator.
+
+    A ULID is a 48-bit millisecond timestamp followed by 80 random bits,
+    written as 26 Crockford base32 characters, so IDs sort by creation time.
+    IDs minted in the same millisecond by this process increment the random
+    part instead of redrawing it, keeping them strictly increasing; across
+    processes the 80 random bits make collisions practically impossible.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def new(self):
+        with self._lock:
+            ms = int(time.time() * 1000)
+            if ms > self._last_ms:
+                random_part = int.from_bytes(os.urandom(10), "big")
+            else:
+                # Same millisecond (or the clock stepped back): stay monotonic
+                ms = self._last_ms
+                random_part = self._last_random + 1
+                if random_part > _RANDOM_MAX:
+                    ms += 1
+                    random_part = int.from_bytes(os.urandom(10), "big")
+            self._last_ms = ms
+            self._last_random = random_part
+        return _encode(ms, 10) + _encode(random_part, 16)
+
+_generator = ULIDGenerator()
+
+def new_session_id():
+    """Mint a unique, time-sortable session ID"""
+    return _generator.new()
+
+def session_id_timestamp(session_id):
+    """Get the creation time of a session ID, for ULIDs and legacy second-resolution IDs"""
+    if len(session_id) == 26:
+        return datetime.fromtimestamp(_decode(session_id[:10]) / 1000, tz=timezone.utc)
+    # Legacy IDs were formatted in the server's local time
+    return datetime.strptime(session_id, LEGACY_FORMAT).astimezone(timezone.utc)
+
+def session_id_bounds(start, end):
+    """Get `(low, high)` ULID bounds for a `$gte`/`$lt` range scan between two datetimes.
+
+    Legacy `YYYYmmdd_HHMMSS` IDs start with "2", and ULIDs only reach that
+    prefix in the year 4199, so legacy IDs never fall inside these bounds.
+    """
+    def floor(moment):
+        return _encode(int(moment.timestamp() * 1000), 10) + "0" * 16
+    return floor(start), floor(end)
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+
+import streamlit as st
+
+from agents import create_agents
+from challenge_cache import get_challenge_cache
+from story_generation import build_intro_pipeline, parse_story
+from swarm import Swarm
+
+class IntroStoryPool:
+    """Bounded pool of ready-made opening stories per first dimension.
+
+    A daemon thread keeps every dimension topped up to `pool_size` stories.
+    `take()` pops a story atomically, so each one is served to exactly one
+    participant, and wakes the worker to generate a replacement.
+    """
+
+    def __init__(self, dimensions, generate, pool_size=2, retry_delay=30):
+        self.dimensions = list(dimensions)
+        self.pool_size = pool_size
+        self.retry_delay = retry_delay
+        self._generate = generate
+        self._stories = {dimension: deque() for dimension in self.dimensions}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.served = 0
+        self.empty = 0
+        self._worker = threading.Thread(target=self._refill_forever, name="intro-story-pool", daemon=True)
+        self._worker.start()
+
+    def take(self, dimension):
+        """Pop a ready `{'story', 'challenge'}` entry for the dimension, or None if the pool is empty"""
+        with self._lock:
+            stories = self._stories.get(dimension)
+            story = stories.popleft() if stories else None
+            if story is None:
+                self.empty += 1
+            else:
+                self.served += 1
+        self._wakeup.set()
+        return story
+
+    def _next_dimension_to_fill(self):
+        """Get the dimension with the fewest ready stories, if any needs refilling"""
+        with self._lock:
+            dimension = min(self.dimensions, key=lambda d: len(self._stories[d]))
+            if len(self._stories[dimension]) >= self.pool_size:
+                return None
+            return dimension
+
+    def _refill_forever(self):
+        while True:
+            dimension = self._next_dimension_to_fill()
+            if dimension is None:
+                # Every pool is full; sleep until a story is taken
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            try:
+                story = self._generate(dimension)
+            except Exception as e:
+                print(f"Intro pool generation error for {dimension}: {str(e)}")
+                time.sleep(self.retry_delay)
+                continue
+            if not story:
+                # Don't spin on a model that keeps returning unusable stories
+                print(f"Intro pool got no story for {dimension}, retrying in {self.retry_delay}s")
+                time.sleep(self.retry_delay)
+                continue
+            with self._lock:
+                self._stories[dimension].append(story)
+
+    def stats(self):
+        """Get the number of ready stories per dimension and serve counters"""
+        with self._lock:
+            return {
+                'ready': {d: len(s) for d, s in self._stories.items()},
+                'served': self.served,
+                'empty': self.empty
+            }
+
+@st.cache_resource
+def get_intro_pool(dimensions):
+    """Get the process-wide intro story pool, starting its worker on first use"""
+    # Resolve shared resources here, on the script thread, and hand them to the worker
+    client = Swarm()
+    _, agent_b, _, agent_intro = create_agents()
+    pipeline = build_intro_pipeline(agent_b, agent_intro, cache=get_challenge_cache())
+
+    def generate(dimension):
+        result = pipeline.run(client, {'dimension': dimension})
+        story = parse_story(result['story'])
+        # Keep the challenge with the story so it can be recorded when served
+        return {'story': story, 'challenge': result['challenge']} if story else None
+
+    return IntroStoryPool(
+        dimensions,
+        generate,
+        pool_size=int(st.secrets.get("intro_pool_size", 2)),
+    )
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import threading
+import time
+
+from bson import json_util
+
+class Journal:
+    """Local append-only journal of pending MongoDB writes, stored in SQLite.
+
+    Every write is committed here first, at local-disk latency, and stays
+    until the replayer has applied it to MongoDB. Rows that failed
+    permanently are kept with their error for inspection.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS writes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                created REAL NOT NULL,
+                error TEXT
+            )
+        """)
+
+    def append(self, collection, operation):
+        """Durably record an operation and return its journal id"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO writes (collection, operation, created) VALUES (?, ?, ?)",
+                (collection, json_util.dumps(operation), time.time())
+            )
+            return cursor.lastrowid
+
+    def pending(self, limit):
+        """Get the oldest unapplied operations as (id, collection, operation) tuples"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, collection, operation FROM writes WHERE error IS NULL ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(row_id, collection, json_util.loads(operation)) for row_id, collection, operation in rows]
+
+    def mark_applied(self, ids):
+        """Drop operations that MongoDB has acknowledged"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM writes WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def mark_failed(self, row_id, error):
+        """Keep a permanently failed operation out of the replay queue"""
+        with self._lock:
+            self._conn.execute("UPDATE writes SET error = ? WHERE id = ?", (error, row_id))
+
+    def backlog(self):
+        """Count operations still waiting to reach MongoDB"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM writes WHERE error IS NULL").fetchone()[0]
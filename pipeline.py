@@ -0,0 +1,207 @@
+import asyncio
+import queue
+
+class PipelineError(Exception):
+    """Raised when a required pipeline step fails after all retries"""
+
+    def __init__(self, step, error):
+        super().__init__(f"Step '{step}' failed: {error!r}")
+        self.step = step
+        self.error = error
+
+class PipelineEvent:
+    """Progress event emitted while a pipeline runs.
+
+    `kind` is one of: started, delta, progress, retry, finished, skipped,
+    failed. For `progress`, `data` is the agent call's ProgressEvent
+    (request sent, first token, tokens received, response received).
+    `completed`/`total` count finished steps so the UI can show real progress.
+    """
+
+    def __init__(self, kind, step, completed, total, data=None):
+        self.kind = kind
+        self.step = step
+        self.completed = completed
+        self.total = total
+        self.data = data
+
+    @property
+    def progress(self):
+        return self.completed / self.total if self.total else 1.0
+
+    @property
+    def status(self):
+        """Short human-readable description for a status line, or None"""
+        if self.kind == 'retry':
+            return f"Retrying {self.step}..."
+        if self.kind != 'progress':
+            return None
+        update = self.data
+        if update.kind == 'request_sent':
+            return f"Waiting for {update.source}..."
+        if update.kind == 'first_token':
+            return f"{update.source} is writing..."
+        if update.kind == 'tokens':
+            return f"{update.source} is writing... ({update.data['count']} tokens)"
+        return None
+
+class Step:
+    """One agent call in a pipeline.
+
+    - `messages(context)` builds the request from the step's declared `inputs`
+    - `output` is the context key the reply is stored under (defaults to `name`)
+    - `knowledge_key(context)` selects the agent's knowledge entry, if any
+    - `cache`/`cache_key(context)` put a get/put cache in front of the call
+    - `stream=True` emits a `delta` event per token while the reply arrives
+    - `optional=True` stores None instead of failing the pipeline
+    - `handoffs=False` keeps the call on this agent even if it has handoff tools
+    """
+
+    def __init__(self, name, agent, messages, inputs=(), output=None, knowledge_key=None,
+                 timeout=None, retries=0, optional=False, stream=False, cache=None, cache_key=None,
+                 handoffs=True):
+        self.name = name
+        self.agent = agent
+        self.messages = messages
+        self.inputs = tuple(inputs)
+        self.output = output or name
+        self.knowledge_key = knowledge_key
+        self.timeout = timeout
+        self.retries = retries
+        self.optional = optional
+        self.stream = stream
+        self.cache = cache
+        self.cache_key = cache_key
+        self.handoffs = handoffs
+
+class Pipeline:
+    """DAG of agent steps wired together by their declared inputs and outputs.
+
+    Steps start as soon as the steps producing their inputs have finished, so
+    independent branches run concurrently on the shared async runtime. Inputs
+    that no step produces must be supplied in the initial context.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self._producers = {step.output: step for step in self.steps}
+        if len(self._producers) != len(self.steps):
+            raise ValueError("Pipeline steps must have unique outputs")
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(step):
+            if step.name in done:
+                return
+            if step.name in visiting:
+                raise ValueError(f"Pipeline has a cycle through step '{step.name}'")
+            visiting.add(step.name)
+            for key in step.inputs:
+                if key in self._producers:
+                    visit(self._producers[key])
+            visiting.discard(step.name)
+            done.add(step.name)
+
+        for step in self.steps:
+            visit(step)
+
+    async def arun(self, swarm, context, on_event=None):
+        """Run every step and return the context extended with their outputs"""
+        context = dict(context)
+        missing = {key for step in self.steps for key in step.inputs
+                   if key not in self._producers and key not in context}
+        if missing:
+            raise ValueError(f"Pipeline inputs missing from context: {sorted(missing)}")
+
+        total = len(self.steps)
+        completed = 0
+        ready = {step.output: asyncio.Event() for step in self.steps}
+
+        def emit(kind, step, data=None):
+            if on_event:
+                on_event(PipelineEvent(kind, step.name, completed, total, data))
+
+        async def call_agent(step):
+            kwargs = {
+                'agent': step.agent,
+                'messages': step.messages(context),
+                'knowledge_key': step.knowledge_key(context) if step.knowledge_key else None,
+                'on_progress': lambda update: emit('progress', step, update)
+            }
+            if not step.stream:
+                response = await swarm.arun(handoffs=step.handoffs, **kwargs)
+                return response.messages[-1]["content"]
+            chunks = []
+            async for delta in swarm.astream(**kwargs):
+                chunks.append(delta)
+                emit('delta', step, delta)
+            return "".join(chunks)
+
+        async def run_step(step):
+            nonlocal completed
+            await asyncio.gather(*(ready[key].wait() for key in step.inputs if key in ready))
+
+            if context.get(step.output) is not None:
+                # Output supplied up front (e.g. a prefetched result)
+                completed += 1
+                emit('skipped', step)
+                ready[step.output].set()
+                return
+
+            cache_key = step.cache_key(context) if step.cache else None
+            result = step.cache.get(cache_key) if step.cache else None
+            if result is not None:
+                context[step.output] = result
+                completed += 1
+                emit('skipped', step)
+                ready[step.output].set()
+                return
+
+            emit('started', step)
+            for attempt in range(step.retries + 1):
+                try:
+                    result = await asyncio.wait_for(call_agent(step), step.timeout)
+                    break
+                except Exception as e:
+                    if attempt < step.retries:
+                        emit('retry', step, e)
+                        continue
+                    if not step.optional:
+                        emit('failed', step, e)
+                        raise PipelineError(step.name, e) from e
+                    print(f"Optional step '{step.name}' failed: {e!r}")
+                    result = None
+
+            if step.cache and result is not None:
+                step.cache.put(cache_key, result)
+            context[step.output] = result
+            completed += 1
+            emit('finished', step)
+            ready[step.output].set()
+
+        tasks = [asyncio.ensure_future(run_step(step)) for step in self.steps]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return context
+
+    def run(self, swarm, context, on_event=None):
+        """Run the pipeline from a synchronous caller such as the Streamlit script.
+
+        The steps execute on the shared async runtime while events are handed
+        back and delivered to `on_event` on the calling thread.
+        """
+        events = queue.Queue()
+        future = swarm.runtime.submit(self.arun(swarm, context, events.put))
+        while not (future.done() and events.empty()):
+            try:
+                event = events.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if on_event:
+                on_event(event)
+        return future.result()
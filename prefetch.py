@@ -0,0 +1,63 @@
+from concurrent.futures import CancelledError
+
+from challenge_cache import get_challenge_cache
+from story_generation import challenge_messages
+
+class ChallengePrefetcher:
+    """Speculatively fetch the upcoming chapter's Agent B challenge.
+
+    One instance lives in each participant's session state. While they type,
+    the challenge for the chapter they are viewing is fetched on the shared
+    async runtime and parked here. Prefetching a different chapter cancels
+    the previous request, so navigating away never leaves stale work behind.
+    """
+
+    def __init__(self, client, agent_b, cache=None):
+        self.client = client
+        self.agent_b = agent_b
+        self.cache = cache or get_challenge_cache()
+        self._key = None
+        self._future = None
+
+    async def _fetch(self, dimension):
+        challenge = self.cache.get(dimension)
+        if challenge is None:
+            response_b = await self.client.arun(self.agent_b, challenge_messages(dimension), knowledge_key=dimension)
+            challenge = response_b.messages[-1]["content"]
+            self.cache.put(dimension, challenge)
+        return challenge
+
+    def prefetch(self, chapter, dimension):
+        """Start fetching the challenge for a chapter unless it is already in flight"""
+        if not dimension or (chapter, dimension) == self._key:
+            return
+        self.cancel()
+        self._key = (chapter, dimension)
+        self._future = self.client.runtime.submit(self._fetch(dimension))
+
+    def cancel(self):
+        """Cancel and discard any pending prefetch"""
+        if self._future is not None:
+            self._future.cancel()
+        self._key = None
+        self._future = None
+
+    def take(self, chapter, dimension, timeout=None):
+        """Consume the prefetched challenge for a chapter.
+
+        Waits up to `timeout` seconds for an in-flight request. Returns None
+        if nothing was prefetched for this chapter or the request failed.
+        """
+        if self._future is None or (chapter, dimension) != self._key:
+            return None
+        future = self._future
+        self._key = None
+        self._future = None
+        try:
+            return future.result(timeout=timeout)
+        except CancelledError:
+            return None
+        except Exception as e:
+            future.cancel()
+            print(f"Challenge prefetch failed: {e!r}")
+            return None
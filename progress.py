@@ -0,0 +1,55 @@
+import threading
+import time
+
+class ProgressEvent:
+    """Structured progress report from an agent call or a storage write.
+
+    Agent calls (Swarm) emit request_sent, first_token, tokens and
+    response_received with the agent's name as `source`. StoryManager emits
+    persisted (journaled locally) and synced (acknowledged by MongoDB) with
+    the collection as `source`.
+    """
+    __slots__ = ('kind', 'source', 'data', 'time')
+
+    def __init__(self, kind, source, data=None):
+        self.kind = kind
+        self.source = source
+        self.data = data or {}
+        self.time = time.monotonic()
+
+    def __repr__(self):
+        return f"ProgressEvent({self.kind!r}, {self.source!r}, {self.data!r})"
+
+class ProgressBus:
+    """Fan progress events out to subscribers.
+
+    Subscribers run on the emitting thread; a failing subscriber is reported
+    and skipped so it can never break the work being reported on.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Register `callback(event)` and return a function that unsubscribes it"""
+        with self._lock:
+            self._subscribers.append(callback)
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def emit(self, kind, source, **data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        event = ProgressEvent(kind, source, data)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Progress subscriber failed on {event!r}: {e!r}")
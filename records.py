@@ -0,0 +1,69 @@
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+def format_timestamp(timestamp):
+    """Convert an epoch timestamp to the ISO string stored in MongoDB"""
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+def parse_timestamp(value):
+    """Convert a stored ISO timestamp back to epoch seconds"""
+    return datetime.fromisoformat(value).timestamp()
+
+class _Record:
+    """Base for the per-session records StoryManager keeps in memory.
+
+    Records hold an epoch-float timestamp and one value. They become Mongo
+    documents only when written, via `to_document()`, where the value is
+    stored under the subclass's `KEY`.
+    """
+    __slots__ = ()
+    KEY = None
+
+    def to_document(self):
+        return {'timestamp': format_timestamp(self.timestamp), self.KEY: getattr(self, self.KEY)}
+
+    @classmethod
+    def from_document(cls, doc):
+        return cls(doc[cls.KEY], parse_timestamp(doc['timestamp']))
+
+@dataclass(slots=True)
+class StorySegment(_Record):
+    KEY = 'segment'
+    segment: str
+    timestamp: float = field(default_factory=time.time)
+
+@dataclass(slots=True)
+class UserPrompt(_Record):
+    KEY = 'prompt'
+    prompt: str
+    timestamp: float = field(default_factory=time.time)
+
+@dataclass(slots=True)
+class ParameterRecord(_Record):
+    KEY = 'parameter'
+    parameter: str
+    timestamp: float = field(default_factory=time.time)
+
+@dataclass(slots=True)
+class ChallengeRecord(_Record):
+    KEY = 'challenge'
+    challenge: str
+    timestamp: float = field(default_factory=time.time)
+
+def deep_sizeof(obj, seen=None):
+    """Approximate memory held by `obj`, following containers and slotted records"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif isinstance(obj, _Record):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
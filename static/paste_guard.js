@@ -0,0 +1,33 @@
+// Block pasting into the design text areas so participants type their own features.
+// Installed once into the app's document: listeners sit on the document in the
+// capture phase, so text areas Streamlit adds or re-renders later are covered
+// without re-scanning the page.
+(function () {
+    if (window.__pasteGuardInstalled) {
+        return;
+    }
+    window.__pasteGuardInstalled = true;
+
+    function isTextarea(e) {
+        return e.target && e.target.tagName === "TEXTAREA";
+    }
+
+    function block(e) {
+        if (isTextarea(e)) {
+            e.preventDefault();
+            e.stopPropagation();
+        }
+    }
+
+    // Disable paste, cut and the context menu (so paste can't be reached that way)
+    ["paste", "cut", "contextmenu"].forEach(function (type) {
+        document.addEventListener(type, block, true);
+    });
+
+    // Disable keyboard shortcuts for paste (Ctrl+V)
+    document.addEventListener("keydown", function (e) {
+        if (isTextarea(e) && e.ctrlKey && (e.key === "v" || e.keyCode === 86)) {
+            e.preventDefault();
+        }
+    }, true);
+})();
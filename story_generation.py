@@ -0,0 +1,139 @@
+import streamlit as st
+
+from challenge_cache import get_challenge_cache
+from pipeline import Pipeline, Step
+
+def challenge_messages(dimension):
+    """Build the Agent B request for a dimension's challenge information"""
+    return [{
+        "role": "system",
+        "content": f"""
+            Selected Dimension: {dimension}
+            Provide challenge information for creating an engaging story.
+        """
+    }]
+
+def feature_analysis_messages(user_input):
+    """Build the Agent A request to analyze a participant's feature"""
+    return [{
+        "role": "user",
+        "content": user_input
+    }]
+
+def parse_story(content):
+    """Get the story text after the STORY: prefix, or None if it is missing"""
+    if "STORY:" not in content:
+        return None
+    return content.split("STORY:")[1].strip()
+
+def intro_story_messages(challenge):
+    """Build the Agent Intro request for an opening story"""
+    return [{
+        "role": "system",
+        "content": f"""
+            Create an opening story that introduces social proxy robots.
+            Use these challenges as inspiration for your story:
+            {challenge}
+        """
+    }]
+
+def chapter_story_messages(user_input, challenge, analysis=None):
+    """Build the Agent D request for the next chapter"""
+    analysis_section = f"""
+            Feature Analysis:
+            {analysis}
+            """ if analysis else ""
+    return [{
+        "role": "system",
+        "content": f"""
+            New Feature: {user_input}
+            {analysis_section}
+            Use these challenges as inspiration for your story:
+            {challenge}
+            
+        """
+    }]
+
+class StoryStreamParser:
+    """Incrementally locate the STORY: prefix in a streamed response"""
+
+    PREFIX = "STORY:"
+
+    def __init__(self):
+        self.text = ""
+        self._story_start = None
+
+    def feed(self, delta):
+        """Add a delta and return the story received so far, or None before the prefix"""
+        searched = len(self.text)
+        self.text += delta
+        if self._story_start is None:
+            # Only rescan the tail in case the prefix was split across deltas
+            index = self.text.find(self.PREFIX, max(0, searched - len(self.PREFIX) + 1))
+            if index == -1:
+                return None
+            self._story_start = index + len(self.PREFIX)
+        return self.text[self._story_start:].lstrip()
+
+def _agent_call_timeout():
+    return float(st.secrets.get("agent_call_timeout", 45))
+
+def _analysis_timeout():
+    return float(st.secrets.get("analysis_timeout", 8))
+
+def challenge_step(agent_b, cache=None):
+    """Agent B lookup for `dimension`, served from the shared challenge cache when possible"""
+    return Step(
+        'challenge',
+        agent_b,
+        lambda context: challenge_messages(context['dimension']),
+        inputs=['dimension'],
+        knowledge_key=lambda context: context['dimension'],
+        timeout=_agent_call_timeout(),
+        retries=1,
+        cache=cache or get_challenge_cache(),
+        cache_key=lambda context: context['dimension']
+    )
+
+def build_intro_pipeline(agent_b, agent_intro, cache=None, stream=False):
+    """Pipeline for the opening story: challenge (B) -> story (Intro)"""
+    return Pipeline([
+        challenge_step(agent_b, cache),
+        Step(
+            'story',
+            agent_intro,
+            lambda context: intro_story_messages(context['challenge']),
+            inputs=['challenge'],
+            timeout=_agent_call_timeout(),
+            stream=stream
+        )
+    ])
+
+def build_chapter_pipeline(agent_a, agent_b, agent_d, cache=None):
+    """Pipeline for a chapter: feature analysis (A) and challenge (B) in parallel -> story (D).
+    
+    A `challenge` already present in the context (e.g. prefetched) skips Agent B.
+    Agent A is optional and gets a short timeout of its own, so it never holds
+    the story back for long: if it is slow or fails, the story is written without it.
+    """
+    return Pipeline([
+        Step(
+            'analysis',
+            agent_a,
+            lambda context: feature_analysis_messages(context['user_input']),
+            inputs=['user_input'],
+            timeout=_analysis_timeout(),
+            optional=True,
+            # Agent B already runs as its own branch, so A shouldn't hand off to it
+            handoffs=False
+        ),
+        challenge_step(agent_b, cache),
+        Step(
+            'story',
+            agent_d,
+            lambda context: chapter_story_messages(context['user_input'], context['challenge'], context['analysis']),
+            inputs=['user_input', 'challenge', 'analysis'],
+            timeout=_agent_call_timeout(),
+            stream=True
+        )
+    ])
@@ -1,7 +1,14 @@
 from datetime import datetime
 import streamlit as st
-from pymongo import MongoClient
+from db import get_mongo_client, ensure_database_ready, index_report, DATABASE_NAME
+from write_behind import get_write_queue
+from ids import new_session_id
+from progress import ProgressBus
+from records import StorySegment, UserPrompt, ParameterRecord, ChallengeRecord, format_timestamp, parse_timestamp, deep_sizeof
 import random
+import threading
+import time
+import uuid
 
 class StoryManager:
     def __init__(self):
@@ -30,69 +37,111 @@ class StoryManager:
             "Chapter 6": "Human Engagement Alignment"
         }
         
-        # Connect to MongoDB
-        self.mongo_client = MongoClient(st.secrets["mongo_uri"])
-        self.db = self.mongo_client.surrogate_stories
+        # Borrow the shared MongoDB client instead of opening a new pool per participant
+        self.mongo_client = get_mongo_client()
+        self.db = self.mongo_client[DATABASE_NAME]
+        # Make sure the session_id lookups below are index-backed (once per process)
+        ensure_database_ready()
+        
+        # Chapters are generated on background threads while the script reads
+        # the session, so the histories and write bookkeeping share a lock
+        self._lock = threading.RLock()
+        
+        # Inserts and updates are journaled locally and replayed into MongoDB;
+        # keep this session's tickets to report durable acknowledgements
+        self.write_queue = get_write_queue()
+        self.pending_writes = []  # (collection, ticket) pairs
+        self.acknowledged_writes = 0
+        self.failed_writes = []
+        self.load_stats = None
+        
+        # Progress events for the UI: `persisted` once a write is journaled
+        # locally, `synced` once MongoDB has acknowledged it
+        self.events = ProgressBus()
         
         # Try to load existing session data
         if 'session_id' in st.session_state:
             self.session_id = st.session_state.session_id
             self._load_session_data()
         else:
-            self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.session_id = new_session_id()
             st.session_state.session_id = self.session_id
         
         # Store Prolific ID
         self.prolific_id = st.session_state.get('prolific_id', '')
     
     def _load_session_data(self):
-        """Load existing session data from MongoDB"""
+        """Load existing session data from MongoDB in a single aggregation"""
+        # Each collection becomes one branch of a $unionWith, matched on the
+        # indexed session_id and projected down to the fields we rebuild
+        def branch(kind, field):
+            return [
+                {'$match': {'session_id': self.session_id}},
+                {'$project': {'_id': 0, 'kind': {'$literal': kind}, 'timestamp': 1, 'value': f'${field}'}}
+            ]
+        
+        pipeline = branch('story', 'segment') + [
+            {'$unionWith': {'coll': 'prompts', 'pipeline': branch('prompt', 'prompt')}},
+            {'$unionWith': {'coll': 'parameters', 'pipeline': branch('parameter', 'parameter')}},
+            {'$unionWith': {'coll': 'challenges', 'pipeline': branch('challenge', 'challenge')}},
+            {'$sort': {'timestamp': 1}}
+        ]
+        targets = {
+            'story': (self.session_story, StorySegment),
+            'prompt': (self.user_prompts, UserPrompt),
+            'parameter': (self.parameter_history, ParameterRecord),
+            'challenge': (self.challenge_history, ChallengeRecord)
+        }
+        
+        start = time.perf_counter()
         try:
-            # Load stories
-            stories = self.db.stories.find({'session_id': self.session_id}).sort('timestamp', 1)
-            for story in stories:
-                self.session_story.append({
-                    'timestamp': story['timestamp'],
-                    'segment': story['segment']
-                })
-                self.current_story = story['segment']
+            documents = 0
+            for doc in self.db.stories.aggregate(pipeline):
+                history, record_type = targets[doc['kind']]
+                history.append(record_type(doc['value'], parse_timestamp(doc['timestamp'])))
+                documents += 1
             
-            # Load other session data...
-            prompts = self.db.prompts.find({'session_id': self.session_id}).sort('timestamp', 1)
-            for prompt in prompts:
-                self.user_prompts.append({
-                    'timestamp': prompt['timestamp'],
-                    'prompt': prompt['prompt']
-                })
+            if self.session_story:
+                self.current_story = self.session_story[-1].segment
             
-            # Similar loading for parameters and challenges...
+            # Expose reload latency so it can be monitored
+            self.load_stats = {
+                'documents': documents,
+                'duration_ms': (time.perf_counter() - start) * 1000
+            }
             
         except Exception as e:
             st.error(f"Error loading session data: {str(e)}")
 
     def add_user_prompt(self, prompt):
-        prompt_data = {
-            'timestamp': datetime.now().isoformat(),
-            'prompt': prompt
-        }
-        self.user_prompts.append(prompt_data)
-        # Save prompt immediately
-        self.db.prompts.insert_one({
+        record = UserPrompt(prompt)
+        with self._lock:
+            self.user_prompts.append(record)
+        # Queue the prompt for the background writer
+        self._queue_insert('prompts', {
             'session_id': self.session_id,
             'prolific_id': self.prolific_id,
-            **prompt_data
+            **record.to_document()
         })
 
     def add_parameter(self, parameter):
-        self.parameter_history.append({
-            'timestamp': datetime.now().isoformat(),
-            'parameter': parameter
+        record = ParameterRecord(parameter)
+        with self._lock:
+            self.parameter_history.append(record)
+        self._queue_insert('parameters', {
+            'session_id': self.session_id,
+            'prolific_id': self.prolific_id,
+            **record.to_document()
         })
 
     def add_challenge(self, challenge):
-        self.challenge_history.append({
-            'timestamp': datetime.now().isoformat(),
-            'challenge': challenge
+        record = ChallengeRecord(challenge)
+        with self._lock:
+            self.challenge_history.append(record)
+        self._queue_insert('challenges', {
+            'session_id': self.session_id,
+            'prolific_id': self.prolific_id,
+            **record.to_document()
         })
 
     def add_story_segment(self, story_text):
@@ -101,52 +150,151 @@ class StoryManager:
             self.current_story = story_text.split("STORY:")[1].strip()
             
             # Add to session history
-            segment_data = {
-                'timestamp': datetime.now().isoformat(),
-                'segment': self.current_story
-            }
-            self.session_story.append(segment_data)
+            segment = StorySegment(self.current_story)
+            with self._lock:
+                self.session_story.append(segment)
+                chapter_number = len(self.session_story)
             
-            # Save story segment immediately
-            try:
-                self.db.stories.insert_one({
-                    'session_id': self.session_id,
-                    'prolific_id': self.prolific_id,
-                    **segment_data
-                })
-            except Exception as e:
-                st.warning(f"Failed to save story to database: {str(e)}")
+            # Queue the story segment for the background writer, keyed by
+            # chapter and starting its append-only revision history
+            self._queue_insert('stories', {
+                'session_id': self.session_id,
+                'prolific_id': self.prolific_id,
+                'chapter_number': chapter_number,
+                'revisions': [{'revision_id': uuid.uuid4().hex, **segment.to_document()}],
+                **segment.to_document()
+            })
+
+    def _queue_insert(self, collection, document):
+        """Journal an insert for the background replayer and track its acknowledgement"""
+        ticket = self.write_queue.insert(collection, document)
+        with self._lock:
+            self.pending_writes.append((collection, ticket))
+        self.events.emit('persisted', collection)
+    
+    def _queue_update(self, collection, filter, update, upsert=False, many=False):
+        """Journal an update for the background replayer and track its acknowledgement"""
+        ticket = self.write_queue.update(collection, filter, update, upsert=upsert, many=many)
+        with self._lock:
+            self.pending_writes.append((collection, ticket))
+        self.events.emit('persisted', collection)
+    
+    def _collect_acknowledgements(self):
+        synced = []
+        with self._lock:
+            still_pending = []
+            for collection, ticket in self.pending_writes:
+                if not ticket.done:
+                    still_pending.append((collection, ticket))
+                elif ticket.ok:
+                    self.acknowledged_writes += 1
+                    synced.append(collection)
+                else:
+                    self.failed_writes.append(ticket.error)
+            self.pending_writes = still_pending
+        for collection in synced:
+            self.events.emit('synced', collection)
+    
+    def flush_writes(self, timeout=10):
+        """Wait for this session's queued writes; True if all were acknowledged"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            tickets = [ticket for _, ticket in self.pending_writes]
+        for ticket in tickets:
+            ticket.wait(max(0, deadline - time.monotonic()))
+        self._collect_acknowledgements()
+        with self._lock:
+            pending = len(self.pending_writes)
+            failed = list(self.failed_writes)
+        if failed:
+            st.warning(f"Some data could not be saved to the database: {failed[-1]}")
+        return not pending and not failed
+    
+    def get_write_status(self):
+        """Get durable-write acknowledgements for this session"""
+        self._collect_acknowledgements()
+        with self._lock:
+            return {
+                'pending': len(self.pending_writes),
+                'acknowledged': self.acknowledged_writes,
+                'failed': len(self.failed_writes)
+            }
 
     def save_session(self):
-        """Save complete session data to MongoDB"""
+        """Save complete session data to MongoDB.
+        
+        Each chapter is journaled as an upsert by (session_id, chapter_number)
+        behind the session's prompts and stories, so saving repeatedly never
+        duplicates chapters and an unreachable MongoDB never loses them;
+        `timestamp` records when a chapter's content last changed.
+        Returns a summary dict once the chapters are journaled, or None if
+        journaling failed. `synced` says whether MongoDB caught up in time.
+        """
         try:
+            saved_at = datetime.now().isoformat()
+            with self._lock:
+                session_story = list(self.session_story)
+                user_prompts = list(self.user_prompts)
             # For each chapter, save a record with session_id, prompt, story, and dimension
-            for i, story in enumerate(self.session_story):
+            for i, story in enumerate(session_story):
                 chapter_data = {
-                    'session_id': self.session_id,
                     'prolific_id': self.prolific_id,
-                    'prompt': self.user_prompts[i]['prompt'] if i < len(self.user_prompts) else None,
-                    'story': story['segment'],
-                    'alignment_dimension': self.get_actual_dimension(f"Chapter {i + 1}"),
-                    'chapter_number': i + 1,
-                    'timestamp': datetime.now().isoformat()
+                    'prompt': user_prompts[i].prompt if i < len(user_prompts) else None,
+                    'story': story.segment,
+                    'alignment_dimension': self.get_actual_dimension(f"Chapter {i + 1}")
                 }
-                
-                # Save to sessions collection
-                self.db.sessions.insert_one(chapter_data)
-            
-            return True
-            
+                self._queue_update(
+                    'sessions',
+                    {'session_id': self.session_id, 'chapter_number': i + 1},
+                    [{'$set': self._chapter_update(chapter_data, saved_at)}],
+                    upsert=True
+                )
         except Exception as e:
-            st.error(f"MongoDB Error: {str(e)}")
-            return False
+            st.error(f"Error saving session data: {str(e)}")
+            return None
+        
+        # Give the replayer a chance to catch up; the data is already durable
+        # in the journal, so a slow replay only shows up as `synced`
+        return {
+            'chapters': len(session_story),
+            'synced': self.flush_writes()
+        }
+
+    @staticmethod
+    def _chapter_update(chapter_data, saved_at):
+        """Update-pipeline $set for one chapter that only moves `timestamp` when its content changed.
+
+        Re-saving an unchanged chapter then leaves the document untouched, so it
+        counts as unchanged and doesn't move the analytics watermark.
+        """
+        unchanged = {'$and': [{'$eq': [f'${key}', {'$literal': value}]} for key, value in chapter_data.items()]}
+        update = {key: {'$literal': value} for key, value in chapter_data.items()}
+        update['timestamp'] = {'$cond': [unchanged, '$timestamp', saved_at]}
+        update['created_at'] = {'$ifNull': ['$created_at', saved_at]}
+        return update
+
+    def get_index_report(self, slow_ms=None):
+        """Get index usage and slow-query stats for the study database"""
+        return index_report(self.db, slow_ms)
+
+    def memory_footprint(self):
+        """Approximate bytes held by this session's story, prompt, parameter and challenge records"""
+        return deep_sizeof([
+            self.current_story,
+            self.session_story,
+            self.user_prompts,
+            self.parameter_history,
+            self.challenge_history
+        ])
 
     def get_complete_story(self):
-        if not self.session_story:
+        with self._lock:
+            session_story = list(self.session_story)
+        if not session_story:
             return ""
         
         # Join all story segments with line breaks
-        complete_story = "\n\n".join(segment['segment'] for segment in self.session_story)
+        complete_story = "\n\n".join(segment.segment for segment in session_story)
         return complete_story.strip()
 
     def reset_dimensions(self):
@@ -217,17 +365,18 @@ class StoryManager:
                 ]
             }
             
-            # Save to database
-            result = self.db.feature_rankings.insert_one(ranking_data)
-            
-            # Also update the session record to indicate rankings were completed
-            self.db.sessions.update_many(
+            # Journal the rankings, then mark the session's chapters as ranked;
+            # the replayer applies both after the chapters themselves
+            self._queue_insert('feature_rankings', ranking_data)
+            self._queue_update(
+                'sessions',
                 {'session_id': self.session_id},
-                {'$set': {'rankings_completed': True, 'rankings_timestamp': datetime.now().isoformat()}}
+                {'$set': {'rankings_completed': True, 'rankings_timestamp': datetime.now().isoformat()}},
+                many=True
             )
             
             # Log success
-            print(f"Rankings saved with ID: {result.inserted_id}")
+            print(f"Rankings journaled for session {self.session_id}")
             return True
             
         except Exception as e:
@@ -237,19 +386,48 @@ class StoryManager:
             return False
 
     def update_chapter_story(self, chapter_number, story_text):
-        """Update the story for a specific chapter"""
-        if 0 < chapter_number <= len(self.session_story):
+        """Update the story for a specific chapter, keeping earlier versions.
+        
+        The new text becomes the chapter's `segment` and is appended to its
+        `revisions` array in one indexed write. The revision_id guard makes a
+        replayed update a no-op instead of a duplicate revision.
+        """
+        with self._lock:
+            if not 0 < chapter_number <= len(self.session_story):
+                return
             # Update the story in memory
-            self.session_story[chapter_number - 1]['segment'] = story_text
-            
-            # Update in database
-            try:
-                self.db.stories.update_one(
-                    {
-                        'session_id': self.session_id,
-                        'timestamp': self.session_story[chapter_number - 1]['timestamp']
-                    },
-                    {'$set': {'segment': story_text}}
-                )
-            except Exception as e:
-                st.warning(f"Failed to update story in database: {str(e)}") 
\ No newline at end of file
+            chapter = self.session_story[chapter_number - 1]
+            chapter.segment = story_text
+        
+        revision_id = uuid.uuid4().hex
+        edited_at = datetime.now().isoformat()
+        # Queue the update behind the chapter's insert. Chapters stored
+        # before chapter_number existed are matched by timestamp once and
+        # get the key backfilled.
+        self._queue_update(
+            'stories',
+            {
+                'session_id': self.session_id,
+                '$or': [
+                    {'chapter_number': chapter_number},
+                    {'chapter_number': {'$exists': False}, 'timestamp': format_timestamp(chapter.timestamp)}
+                ],
+                'revisions.revision_id': {'$ne': revision_id}
+            },
+            {
+                '$set': {'segment': story_text, 'chapter_number': chapter_number, 'edited_at': edited_at},
+                '$push': {'revisions': {'revision_id': revision_id, 'timestamp': edited_at, 'segment': story_text}}
+            }
+        )
+    
+    def get_chapter_revisions(self, chapter_number):
+        """Get every stored version of a chapter, oldest first"""
+        try:
+            doc = self.db.stories.find_one(
+                {'session_id': self.session_id, 'chapter_number': chapter_number},
+                {'_id': 0, 'revisions': 1}
+            )
+            return doc.get('revisions', []) if doc else []
+        except Exception as e:
+            st.error(f"Error loading chapter revisions: {str(e)}")
+            return [] 
\ No newline at end of file
@@ -2,388 +2,78 @@ import streamlit as st
 from swarm import Swarm
 from agents import create_agents
 from story_manager import StoryManager
+from db import get_mongo_client
+from story_generation import build_chapter_pipeline, build_intro_pipeline, parse_story, StoryStreamParser
+from intro_pool import get_intro_pool
+from prefetch import ChallengePrefetcher
+from generation_jobs import get_generation_executor, generate_chapter, request_key
+import streamlit.components.v1 as components
 import pandas as pd
-from datetime import datetime
+from functools import lru_cache
+import hashlib
+import os
 import time
 
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_ASSETS = ("app.css", "paste_guard.js")
+
+@lru_cache(maxsize=1)
+def static_assets_version():
+    """Content hash of the static assets, used to version their URLs"""
+    digest = hashlib.sha256()
+    for name in STATIC_ASSETS:
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+# Runs once per page: fetches the versioned stylesheet and paste guard from
+# the static server (browser-cached) and installs them into the app document.
+# Streamlit serves .css/.js as text/plain, so they are inlined rather than linked.
+STATIC_ASSETS_LOADER = """
+<script>
+(function () {
+    var root = window.parent;
+    var version = "%(version)s";
+    if (root.__staticAssetsVersion === version) {
+        return;
+    }
+    root.__staticAssetsVersion = version;
+    var doc = root.document;
+
+    function load(name) {
+        var url = new URL("app/static/" + name + "?v=" + version, doc.baseURI);
+        return fetch(url.href).then(function (response) { return response.text(); });
+    }
+
+    load("app.css").then(function (css) {
+        var style = doc.getElementById("app-static-style");
+        if (!style) {
+            style = doc.createElement("style");
+            style.id = "app-static-style";
+            doc.head.appendChild(style);
+        }
+        style.textContent = css;
+    });
+    load("paste_guard.js").then(function (code) {
+        var script = doc.createElement("script");
+        script.textContent = code;
+        doc.head.appendChild(script);
+    });
+})();
+</script>
+"""
+
 def set_custom_style():
-    st.markdown("""
-        <style>
-        /* Modern, high-contrast theme */
-        .stApp {
-            max-width: 1400px;
-            margin: 0 auto;
-            background-color: #ffffff !important;
-        }
-        
-        /* Updated Story box with paper-like appearance */
-        .story-box {        
-            background-color: #fff9f0;  /* Slightly off-white, paper-like color */
-            border-radius: 3px;
-            padding: 30px;
-            margin: 15px 0;
-            font-family: 'Crimson Text', Georgia, serif;  /* More story-like font */
-            box-shadow: 0 0 15px rgba(0,0,0,0.1);
-            color: #2c3e50;
-            font-size: 18px;
-            line-height: 1.8;
-            border: none;
-            position: relative;
-            background-image: linear-gradient(#e5e5e5 1px, transparent 1px);
-            background-size: 100% 1.8em;
-            min-height: 200px;
-            text-align: left;
-        }
-        
-        /* Paper texture and edges */
-        .story-box::before {
-            content: '';
-            position: absolute;
-            left: 0;
-            top: 0;
-            width: 100%;
-            height: 100%;
-            background-image: 
-                url('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAADIAAAAyCAMAAAAp4XiDAAAAUVBMVEWFhYWDg4N3d3dtbW17e3t1dXWBgYGHh4d5eXlzc3OLi4ubm5uVlZWPj4+NjY19fX2JiYl/f39ra2uRkZGZmZlpaWmXl5dvb29xcXGTk5NnZ2c8TV1mAAAAG3RSTlNAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEAvEOwtAAAFVklEQVR4XpWWB67c2BUFb3g557T/hRo9/WUMZHlgr4Bg8Z4qQgQJlHI4A8SzFVrapvmTF9O7dmYRFZ60YiBhJRCgh1FYhiLAmdvX0CzTOpNE77ME0Zty/nWWzchDtiqrmQDeuv3powQ5ta2eN0FY0InkqDD73lT9c9lEzwUNqgFHs9VQce3TVClFCQrSTfOiYkVJQBmpbq2L6iZavPnAPcoU0dSw0SUTqz/GtrGuXfbyyBniKykOWQWGqwwMA7QiYAxi+IlPdqo+hYHnUt5ZPfnsHJyNiDtnpJyayNBkF6cWoYGAMY92U2hXHF/C1M8uP/ZtYdiuj26UdAdQQSXQErwSOMzt/XWRWAz5GuSBIkwG1H3FabJ2OsUOUhGC6tK4EMtJO0ttC6IBD3kM0ve0tJwMdSfjZo+EEISaeTr9P3wYrGjXqyC1krcKdhMpxEnt5JetoulscpyzhXN5FRpuPHvbeQaKxFAEB6EN+cYN6xD7RYGpXpNndMmZgM5Dcs3YSNFDHUo2LGfZuukSWyUYirJAdYbF3MfqEKmjM+I2EfhA94iG3L7uKrR+GdWD73ydlIB+6hgref1QTlmgmbM3/LeX5GI1Ux1RWpgxpLuZ2+I+IjzZ8wqE4nilvQdkUdfhzI5QDWy+kw5Wgg2pGpeEVeCCA7b85BO3F9DzxB3cdqvBzWcmzbyMiqhzuYqtHRVG2y4x+KOlnyqla8AoWWpuBoYRxzXrfKuILl6SfiWCbjxoZJUaCBj1CjH7GIaDbc9kqBY3W/Rgjda1iqQcOJu2WW+76pZC9QG7M00dffe9hNnseupFL53r8F7YHSwJWUKP2q+k7RdsxyOB11n0xtOvnW4irMMFNV4H0uqwS5ExsmP9AxbDTc9JwgneAT5vTiUSm1E7BSflSt3bfa1tv8Di3R8n3Af7MNWzs49hmauE2wP+ttrq+AsWpFG2awvsuOqbipWHgtuvuaAE+A1Z/7gC9hesnr+7wqCwG8c5yAg3AL1fm8T9AZtp/bbJGwl1pNrE7RuOX7PeMRUERVaPpEs+yqeoSmuOlokqw49pgomjLeh7icHNlG19yjs6XXOMedYm5xH2YxpV2tc0Ro2jJfxC50ApuxGob7lMsxfTbeUv07TyYxpeLucEH1gNd4IKH2LAg5TdVhlCafZvpskfncCfx8pOhJzd76bJWeYFnFciwcYfubRc12Ip/ppIhA1/mSZ/RxjFDrJC5xifFjJpY2Xl5zXdguFqYyTR1zSp1Y9p+tktDYYSNflcxI0iyO4TPBdlRcpeqjK/piF5bklq77VSEaA+z8qmJTFzIWiitbnzR794USKBUaT0NTEsVjZqLaFVqJoPN9ODG70IPbfBHKK+/q/AWR0tJzYHRULOa4MP+W/HfGadZUbfw177G7j/OGbIs8TahLyynl4X4RinF793Oz+BU0saXtUHrVBFT/DnA3ctNPoGbs4hRIjTok8i+algT1lTHi4SxFvONKNrgQFAq2/gFnWMXgwffgYMJpiKYkmW3tTg3ZQ9Jq+f8XN+A5eeUKHWvJWJ2sgJ1Sop+wwhqFVijqWaJhwtD8MNlSBeWNNWTa5Z5kPZw5+LbVT99wqTdx29lMUH4OIG/D86ruKEauBjvH5xy6um/Sfj7ei6UUVk4AIl3MyD4MSSTOFgSwsH/QJWaQ5as7ZcmgBZkzjjU1UrQ74ci1gWBCSGHtuV1H2mhSnO3Wp/3fEV5a+4wz//6qy8JxjZsmxxy5+4w9CDNJY09T072iKG0EnOS0arEYgXqYnXcYHwjTtUNAcMelOd4xpkoqiTYICWFq0JSiPfPDQdnt+4/wuqcXY47QILbgAAAABJRU5ErkJggg==');
-            opacity: 0.03;
-            pointer-events: none;
-        }
-        
-        .story-box::after {
-            content: '';
-            position: absolute;
-            left: -5px;
-            top: 0;
-            width: 4px;
-            height: 100%;
-            background: linear-gradient(to right, #d4d4d4, transparent);
-            border-left: 1px solid #e0e0e0;
-        }
-        
-        /* Story line animation with pen-writing effect */
-        .story-line {
-            opacity: 0;
-            animation: fadeInLine 1s ease-out forwards;
-            position: relative;
-            margin-bottom: 1.8em;
-            padding-left: 10px;
-        }
-        
-        /* Pen cursor effect */
-        .story-line::before {
-            content: '✎';
-            position: absolute;
-            left: -20px;
-            opacity: 0;
-            color: #3498db;
-            animation: writingCursor 0.5s ease-in-out forwards;
-            animation-delay: inherit;
-        }
-        
-        @keyframes writingCursor {
-            0% {
-                opacity: 0;
-                transform: translateX(-10px);
-            }
-            50% {
-                opacity: 1;
-            }
-            100% {
-                opacity: 0;
-                transform: translateX(5px);
-            }
-        }
-        
-        /* Enhanced typing animation */
-        @keyframes fadeInLine {
-            0% {
-                opacity: 0;
-                transform: translateY(10px);
-            }
-            100% {
-                opacity: 1;
-                transform: translateY(0);
-            }
-        }
-        
-        .delay-1 { animation-delay: 0.3s; }
-        .delay-2 { animation-delay: 0.6s; }
-        .delay-3 { animation-delay: 0.9s; }
-        .delay-4 { animation-delay: 1.2s; }
-        .delay-5 { animation-delay: 1.5s; }
-        
-        /* Story header styling */
-        .header-style {
-            font-family: 'Crimson Text', Georgia, serif;
-            color: #2c3e50;
-            font-size: 28px;
-            font-weight: 600;
-            margin: 25px 0 15px 0;
-            padding-bottom: 8px;
-            border-bottom: 2px solid #3498db;
-            text-shadow: 1px 1px 2px rgba(0,0,0,0.1);
-        }
-        
-        /* Challenge box */
-        .challenge-box {
-            background-color: #f8f9fa;
-            border-radius: 8px;
-            padding: 15px 20px;
-            margin: 12px 0;
-            font-family: 'Inter', sans-serif;
-            box-shadow: 0 2px 6px rgba(0,0,0,0.08);
-            color: #2c3e50;
-            border-left: 4px solid #e74c3c;
-        }
-        
-        /* Headers */
-        .header-style {
-            color: #2c3e50;
-            font-size: 24px;
-            font-weight: 600;
-            margin: 25px 0 15px 0;
-            font-family: 'Inter', sans-serif;
-            border-bottom: 2px solid #3498db;
-            padding-bottom: 8px;
-        }
-        
-        /* Info boxes */
-        .stAlert {
-            background-color: #f8f9fa !important;
-            color: #2c3e50 !important;
-            border: 1px solid #e0e0e0 !important;
-            border-radius: 8px !important;
-        }
-        
-        /* Buttons */
-        .stButton button {
-            background-color: #3498db !important;
-            color: white !important;
-            font-weight: 500 !important;
-            border: none !important;
-            padding: 10px 20px !important;
-            border-radius: 8px !important;
-        }
-        
-        /* Text areas */
-        .stTextArea textarea {
-            background-color: #ffffff !important;
-            border-radius: 8px !important;
-            border: 2px solid #e0e0e0 !important;
-            padding: 12px !important;
-            font-size: 16px !important;
-            color: #2c3e50 !important;
-        }
-        
-        /* Text area placeholder */
-        .stTextArea textarea::placeholder {
-            color: #95a5a6 !important;
-            opacity: 1 !important;
-        }
-        
-        /* Text area focus state */
-        .stTextArea textarea:focus {
-            border-color: #3498db !important;
-            box-shadow: 0 0 0 1px #3498db !important;
-        }
-        
-        /* Sidebar */
-        .css-1d391kg {
-            background-color: #f8f9fa !important;
-        }
-        
-        /* Text colors */
-        p, h1, h2, h3, h4, h5, h6, .stMarkdown {
-            color: #2c3e50 !important;
-        }
-        
-        /* Example text */
-        em {
-            color: #666666 !important;
-        }
-        
-        /* Typing animation */
-        @keyframes typing {
-            from { width: 0 }
-            to { width: 100% }
-        }
-        
-        .typing-effect {
-            overflow: hidden;
-            white-space: pre-wrap;
-            animation: typing 2s steps(40, end);
-        }
-        
-        /* Section dividers */
-        hr {
-            margin: 30px 0;
-            border: none;
-            border-top: 2px solid #e0e0e0;
-        }
-        
-        /* Toggle switch styling */
-        .stCheckbox {
-            background-color: white !important;
-            padding: 10px !important;
-            border-radius: 8px !important;
-            border: 1px solid #e0e0e0 !important;
-        }
-        
-        .stCheckbox label {
-            color: #2c3e50 !important;
-            font-weight: 500 !important;
-        }
-        
-        /* Info text under design input */
-        .stAlert > div {
-            color: #2c3e50 !important;
-            background-color: #f8f9fa !important;
-            border: 1px solid #e0e0e0 !important;
-        }
-        
-        /* Improved typing animation */
-        @keyframes fadeInLine {
-            from { 
-                opacity: 0;
-                transform: translateY(10px);
-            }
-            to { 
-                opacity: 1;
-                transform: translateY(0);
-            }
-        }
-        
-        .story-line {
-            opacity: 0;
-            animation: fadeInLine 0.5s ease-out forwards;
-        }
-        
-        .delay-1 { animation-delay: 0.5s; }
-        .delay-2 { animation-delay: 1.0s; }
-        .delay-3 { animation-delay: 1.5s; }
-        /* Add more delays as needed */
-        
-        .instruction-box {
-            background-color: #f8f9fa;
-            border-left: 4px solid #3498db;
-            padding: 20px 25px;
-            margin: 20px 0;
-            border-radius: 5px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }
-        
-        .instruction-box h3 {
-            color: #2c3e50;
-            margin-bottom: 15px;
-            font-size: 1.3em;
-        }
-        
-        .instruction-box h4 {
-            color: #3498db;
-            margin: 20px 0 10px 0;
-            font-size: 1.1em;
-        }
-        
-        .instruction-box ol, .instruction-box ul {
-            margin-left: 20px;
-            color: #2c3e50;
-        }
-        
-        .instruction-box li {
-            margin: 8px 0;
-            line-height: 1.5;
-        }
-        
-        .instruction-box p {
-            color: #2c3e50;
-            line-height: 1.6;
-        }
-        
-        .feature-box {
-            background-color: #1e1e1e;
-            border-left: 3px solid #3498db;
-            padding: 15px;
-            margin-bottom: 15px;
-            border-radius: 5px;
-        }
-        
-        .feature-number {
-            color: #3498db;
-            font-weight: bold;
-            font-size: 1.1em;
-            margin-right: 10px;
-        }
-        
-        .feature-text {
-            color: #ffffff;
-            margin-top: 5px;
-            font-size: 0.95em;
-            line-height: 1.4;
-        }
-        
-        /* Specific styling for ranking feature text to prevent color conflict */
-        .ranking-feature-text {
-            background-color: #f8f9fa;
-            border-left: 4px solid #3498db;
-            padding: 12px 15px;
-            margin: 8px 0;
-            border-radius: 4px;
-            font-size: 15px;
-            color: #2c3e50;
-            line-height: 1.4;
-        }
-        
-        /* Style the number input */
-        div[data-testid="stNumberInput"] input {
-            font-size: 16px;
-            font-weight: bold;
-            text-align: center;
-        }
-        
-        /* Add space between ranking rows */
-        .stForm > div > div > div {
-            margin-bottom: 8px;
-        }
-        
-        /* Custom styling for the Prolific ID input */
-        [data-testid="stTextInput"] input {
-            border: 1px solid #e0e0e0 !important;
-            border-radius: 6px !important;
-            padding: 12px 15px !important;
-            font-size: 16px !important;
-            transition: border-color 0.3s ease !important;
-            background-color: #f9f9fa !important;
-            color: #2c3e50 !important;  /* Adding dark text color for visibility */
-        }
-        [data-testid="stTextInput"] input::placeholder {
-            color: #95a5a6 !important;  /* Adding placeholder color for better contrast */
-            opacity: 1 !important;
-        }
-        [data-testid="stTextInput"] input:focus {
-            border-color: #3498db !important;
-            box-shadow: 0 0 0 1px #3498db !important;
-        }
-        /* Style the warning message */
-        .stAlert > div {
-            border-radius: 6px !important;
-            padding: 10px 15px !important;
-        }
-        
-        /* Style to identify our special text area */
-        .no-paste-text-area textarea {
-            border: 1px solid #e0e0e0 !important;
-            border-radius: 8px !important;
-            padding: 12px !important;
-            font-size: 16px !important;
-            background-color: #ffffff !important;
-            color: #2c3e50 !important;
-            height: 100px;
-            width: 100%;
-        }
-        </style>
-    """, unsafe_allow_html=True)
+    """Install the app stylesheet and paste guard.
+    
+    Rendered first on every run with identical arguments, so the browser keeps
+    the same iframe and the loader script only ever runs once per page.
+    """
+    components.html(STATIC_ASSETS_LOADER % {'version': static_assets_version()}, height=0)
 
-def display_story_with_animation(story_text, container):
+@lru_cache(maxsize=512)
+def story_html(story_text):
+    """Build the animated story box markup; memoized since chapters are re-shown on every visit"""
     # Split story into lines
     lines = story_text.split('\n')
     story_html = ""
@@ -397,49 +87,277 @@ def display_story_with_animation(story_text, container):
             delay_class = f"delay-{i}"
             story_html += f'<div class="story-line {delay_class}">{line}</div>'
     
+    return f"""<div class="story-box">
+            {story_html}
+        </div>"""
+
+def display_story_with_animation(story_text, container):
+    container.markdown(story_html(story_text), unsafe_allow_html=True)
+
+def display_streaming_story(story_text, container):
+    """Draw a partially received story without the line-by-line fade-in"""
+    lines = [line for line in story_text.split('\n') if line.strip()]
+    story_html = "".join(f'<div class="story-line">{line}</div>' for line in lines)
     container.markdown(
-        f"""<div class="story-box">
+        f"""<div class="story-box story-streaming">
             {story_html}
         </div>""",
         unsafe_allow_html=True
     )
 
+class StreamingStoryBox:
+    """Story box that is redrawn as a streamed STORY: response arrives"""
+    
+    def __init__(self, container):
+        self.placeholder = container.empty()
+        self.reset()
+    
+    def reset(self):
+        """Start over, e.g. when the story step is retried"""
+        self.parser = StoryStreamParser()
+        self.story_so_far = None
+        self.last_render = 0.0
+    
+    def render(self):
+        display_streaming_story(self.story_so_far, self.placeholder)
+    
+    def feed(self, delta):
+        self.story_so_far = self.parser.feed(delta)
+        # Throttle redraws so we don't send one websocket message per token
+        if self.story_so_far and time.monotonic() - self.last_render >= 0.05:
+            self.render()
+            self.last_render = time.monotonic()
+    
+    def finish(self):
+        """Draw whatever arrived since the last redraw and return the full response"""
+        if self.story_so_far:
+            self.render()
+        return self.parser.text
+
+class ProgressDisplay:
+    """Progress bar and status line driven by real agent and storage events.
+    
+    The pipeline's steps fill the bar up to 95%; the story being journaled
+    locally completes it.
+    """
+    
+    def __init__(self, container):
+        self.bar = container.progress(0)
+        self.status = container.empty()
+        self.fraction = 0.0
+    
+    def update(self, fraction, text=None):
+        # Retries never move the bar backwards
+        self.fraction = max(self.fraction, fraction)
+        self.bar.progress(int(self.fraction * 100))
+        if text:
+            self.status.caption(text)
+    
+    def on_pipeline_event(self, event):
+        self.update(0.95 * event.progress, event.status)
+    
+    def on_store_event(self, event):
+        if event.kind != 'persisted':
+            return
+        if event.source == 'stories':
+            self.update(1.0, "Story saved")
+        else:
+            self.status.caption(f"Saved {event.source}")
+
+def run_story_pipeline(pipeline, context, progress):
+    """Run a story pipeline, streaming its story and driving the progress display from its events"""
+    story_box = StreamingStoryBox(st)
+    
+    def on_event(event):
+        if event.kind == 'delta':
+            story_box.feed(event.data)
+            return
+        if event.kind == 'retry' and event.step == 'story':
+            story_box.reset()
+        progress.on_pipeline_event(event)
+    
+    result = pipeline.run(st.session_state.client, context, on_event)
+    story_box.finish()
+    return result
+
+def generation_key():
+    """Key of the participant's background chapter job, or None"""
+    return st.session_state.get('generation_key')
+
+@st.fragment(run_every=0.5)
+def generation_status():
+    """Poll the participant's background chapter job, showing its progress until it finishes.
+    
+    Only this fragment reruns while the job is working, so the participant can
+    keep browsing chapters; the full app reruns once the result is in.
+    """
+    executor = get_generation_executor()
+    key = generation_key()
+    job = executor.get(key) if key else None
+    
+    if job is not None and not job.done:
+        st.markdown("<p style='text-align:center; color:#3498db;'>Generating your story...</p>", unsafe_allow_html=True)
+        st.progress(int(job.fraction * 100))
+        st.caption(job.status)
+        if job.story_so_far:
+            display_streaming_story(job.story_so_far, st)
+        return
+    
+    # Finished (or lost with a server restart): apply the outcome and rerun the whole page.
+    # Successful jobs stay with the executor so a repeated request gets the cached story.
+    st.session_state.generation_key = None
+    if job is None:
+        st.session_state.generation_error = "Story generation was interrupted, please try again."
+    elif job.error is not None:
+        executor.discard(key)
+        st.session_state.generation_error = f"Error generating story: {str(job.error)}"
+    else:
+        # Start the next feature with an empty text box
+        st.session_state.input_key += 1
+        # Move to the new chapter, or stay on the revised one
+        if not job.result['revised']:
+            st.session_state.viewing_chapter = len(st.session_state.story_manager.session_story)
+        # Check if this was Chapter 6
+        if job.result['chapter'] == 6:
+            # End session automatically
+            end_session()
+    st.rerun()
+
+def get_viewing_chapter():
+    """Chapter the participant is looking at, defaulting to the current one"""
+    return st.session_state.get('viewing_chapter', len(st.session_state.story_manager.covered_dimensions))
+
+def set_viewing_chapter(chapter):
+    st.session_state.viewing_chapter = chapter
+
+@st.fragment
+def chapter_viewer():
+    """Chapter navigation, story box and the chapter's design prompt"""
+    story_manager = st.session_state.story_manager
+    total_chapters = len(story_manager.session_story)
+    viewing_chapter = get_viewing_chapter()
+    
+    # Chapter Navigation - the buttons only rerun this fragment
+    nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
+    
+    with nav_col1:
+        if viewing_chapter > 1:  # Can go back if not at first chapter
+            st.button("←", on_click=set_viewing_chapter, args=(viewing_chapter - 1,))
+    
+    with nav_col2:
+        st.markdown(f"### Chapter {viewing_chapter}", unsafe_allow_html=True)
+    
+    with nav_col3:
+        if viewing_chapter < total_chapters:  # Can go forward if not at last chapter
+            st.button("→", on_click=set_viewing_chapter, args=(viewing_chapter + 1,))
+    
+    # Chapter Story Display
+    if viewing_chapter > 0 and viewing_chapter <= total_chapters:
+        display_story_with_animation(story_manager.session_story[viewing_chapter - 1].segment, st)
+    
+    # Start fetching this chapter's challenge while the participant writes their feature
+    if viewing_chapter > 0 and not generation_key():
+        st.session_state.prefetcher.prefetch(
+            viewing_chapter,
+            story_manager.get_actual_dimension(f"Chapter {viewing_chapter}")
+        )
+    
+    if viewing_chapter > 0:
+        # Design input section
+        st.markdown("<div class='header-style'>Design Input</div>", unsafe_allow_html=True)
+        st.info(f"""
+        **Before adding feature to Chapter {viewing_chapter}, please consider the following:**
+        - How would you enhance the current functionality?
+        - Why do you think this feature is important?
+        
+        
+        **Example format:**
+        - Add <FEATURE 1> because <REASON>
+        - Add <FEATURE 2> because <REASON> and so on...
+        
+        **Please add more than one feature in the dialog box below.**
+
+        """)
+
+@st.fragment
+def design_input():
+    """Feature text area and Next Chapter button.
+    
+    The feature is added to whichever chapter is being viewed when the button
+    is clicked, so the draft survives browsing other chapters.
+    """
+    # User input (without copy-paste warning)
+    user_input = st.text_area(
+        "Enter your design idea:",
+        key=f"user_input_{st.session_state.input_key}",
+        height=100,
+        placeholder="Describe your design idea here..."
+    )
+    
+    # Pasting is blocked by the paste guard installed once with the stylesheet
+    
+    # Create columns for buttons - just one column for generate button
+    generate_col1, generate_col2 = st.columns([1, 2])
+    
+    with generate_col1:
+        # One chapter at a time: the button stays disabled while a job is running
+        generate_button = st.button("🚀 Next Chapter", use_container_width=True, disabled=bool(generation_key()))
+    
+    if 'generation_error' in st.session_state:
+        st.error(st.session_state.pop('generation_error'))
+    
+    # Hand generation to the background pool so the page stays responsive
+    if generate_button and user_input and not generation_key():
+        story_manager = st.session_state.story_manager
+        viewing_chapter = get_viewing_chapter()
+        current_chapter = len(story_manager.covered_dimensions)
+        # Identical requests join the in-flight job or reuse its finished story
+        key = request_key(story_manager.session_id, viewing_chapter, user_input)
+        # Use the dimension from the current viewing chapter
+        current_dimension = story_manager.get_actual_dimension(f"Chapter {viewing_chapter}")
+        
+        # Resolve everything the job needs here, on the script thread
+        swarm = st.session_state.client
+        pipeline = build_chapter_pipeline(st.session_state.agent_a, st.session_state.agent_b, st.session_state.agent_d)
+        prefetcher = st.session_state.prefetcher
+        # Adding to a previous chapter rewrites it; otherwise a new chapter is created
+        revise = viewing_chapter < current_chapter
+        challenge_timeout = float(st.secrets.get("agent_call_timeout", 45))
+        
+        get_generation_executor().submit(key, lambda job: generate_chapter(
+            job, swarm, pipeline, story_manager, prefetcher,
+            user_input, viewing_chapter, current_dimension, revise, challenge_timeout
+        ))
+        st.session_state.generation_key = key
+        # Rerun the page once so the progress poller starts and the button disables
+        st.rerun()
+
+@lru_cache(maxsize=512)
+def feature_history_html(prompts):
+    """Build the numbered feature list; memoized on the tuple of prompts"""
+    return "".join(
+        f"""<div class='feature-box'>
+            <span class='feature-number'>#{i}</span>
+            <div class='feature-text'>{prompt}</div>
+        </div>"""
+        for i, prompt in enumerate(prompts, 1)
+    )
+
+@st.fragment
+def feature_history():
+    """Feature history panel; the toggle reruns only this fragment"""
+    st.markdown("<div class='header-style'>Feature History</div>", unsafe_allow_html=True)
+    
+    show_history = st.toggle("Show Previous Features", value=True)
+    
+    if show_history and st.session_state.story_manager.user_prompts:
+        # Render the numbered list of all prompts in one element
+        prompts = tuple(prompt_data.prompt for prompt_data in st.session_state.story_manager.user_prompts)
+        st.markdown(feature_history_html(prompts), unsafe_allow_html=True)
+
 def display_instructions():
     # Professional Prolific ID input with clean styling
     st.markdown("""
-        <style>
-        .prolific-container {
-            background-color: #ffffff;
-            border: 1px solid #e0e0e0;
-            border-radius: 8px;
-            padding: 20px;
-            margin-bottom: 30px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        }
-        .prolific-label {
-            font-weight: 600;
-            font-size: 16px;
-            margin-bottom: 10px;
-            color: #2c3e50;
-            display: flex;
-            align-items: center;
-        }
-        .required-asterisk {
-            color: #e74c3c;
-            font-weight: bold;
-            font-size: 18px;
-            margin-left: 4px;
-        }
-        .prolific-input {
-            margin-top: 5px;
-        }
-        .prolific-note {
-            font-size: 14px;
-            color: #7f8c8d;
-            margin-top: 8px;
-            font-style: italic;
-        }
-        </style>
         <div class="prolific-container">
             <div class="prolific-label">
                 Prolific ID <span class="required-asterisk">*</span>
@@ -506,15 +424,6 @@ def display_instructions():
         if prolific_id:
             start_button = st.button("Start Experience", use_container_width=True, type="primary")
             if start_button:
-                # Show loading progress bar while initializing - use a simpler approach
-                st.markdown("<p style='text-align:center; color:#3498db;'>Initializing your experience...</p>", unsafe_allow_html=True)
-                progress_bar = st.progress(0)
-                
-                # Use fewer steps to reduce potential for ElementNode errors
-                for percent_complete in [0, 25, 50, 75, 100]:
-                    progress_bar.progress(percent_complete)
-                    time.sleep(0.2)  # Slower updates are less likely to cause rendering issues
-                
                 # Store Prolific ID in session state
                 st.session_state.prolific_id = prolific_id
                 return True
@@ -527,12 +436,18 @@ def display_instructions():
 def end_session():
     """Handle end of session and save data"""
     try:
+        # Drop any speculative work for a chapter that will never be written
+        if 'prefetcher' in st.session_state:
+            st.session_state.prefetcher.cancel()
+        
         # Save session data first
         session_saved = st.session_state.story_manager.save_session()
         
         # Clear the screen by setting session state
         st.session_state.ended = True
-        st.session_state.save_status = session_saved  # Track save status
+        # Writes still replaying from the local journal are durable; the
+        # sidebar reports that lag, so only a failed save counts here
+        st.session_state.save_status = session_saved is not None
         st.rerun()
         
     except Exception as e:
@@ -545,12 +460,12 @@ def main():
         initial_sidebar_state="expanded"
     )
     
-    st.markdown("""
-        <link href="https://fonts.googleapis.com/css2?family=Crimson+Text:ital,wght@0,400;0,600;1,400&display=swap" rel="stylesheet">
-    """, unsafe_allow_html=True)
-    
+    # Stylesheet (including the Crimson Text font) and paste guard
     set_custom_style()
     
+    # Create and warm up the shared MongoDB pool on the first run after server start
+    get_mongo_client()
+    
     # Initialize new session state every time
     if 'story_manager' not in st.session_state or not st.session_state.get('started', False):
         st.session_state.started = False
@@ -559,8 +474,11 @@ def main():
         st.session_state.client = Swarm()
         # Unpack all 4 agents
         st.session_state.agent_a, st.session_state.agent_b, st.session_state.agent_d, st.session_state.agent_intro = create_agents()
+        st.session_state.prefetcher = ChallengePrefetcher(st.session_state.client, st.session_state.agent_b)
         st.session_state.input_key = 0
-        st.session_state.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    # Start (or keep) the shared intro story pool filling in the background
+    intro_pool = get_intro_pool(tuple(st.session_state.story_manager.dimension_mapping.values()))
     
     # Sidebar content - show this regardless of started state
     with st.sidebar:
@@ -577,62 +495,23 @@ def main():
             </ul>
         </div>
         """, unsafe_allow_html=True)
+        
+        # Durable-write status for this participant's prompts and stories
+        if st.session_state.get('started', False):
+            write_status = st.session_state.story_manager.get_write_status()
+            if write_status['failed']:
+                st.caption("⚠️ Some of your progress could not be saved")
+            elif write_status['pending']:
+                st.caption("💾 Progress saved locally, syncing to the database...")
+            else:
+                st.caption("✓ All progress saved")
     
     # Main content
     st.markdown("<h1 style='text-align: center; color: #1f77b4;'>Interactive Social Proxy Story Generator</h1>", unsafe_allow_html=True)
     
     # Check if session has ended
     if st.session_state.get('ended', False):
-        # Clean, centered layout
-        st.markdown("""
-            <style>
-            .session-complete {
-                text-align: center;
-                max-width: 800px;
-                margin: 0 auto;
-                padding: 20px;
-            }
-            .completion-code {
-                background-color: #f5f5f5;
-                border: 1px solid #e0e0e0;
-                border-radius: 5px;
-                padding: 15px;
-                margin: 20px auto;
-                font-size: 18px;
-                font-weight: bold;
-                max-width: 400px;
-            }
-            .feature-card {
-                background-color: #f8f9fa;
-                border-left: 4px solid #3498db;
-                padding: 12px 15px;
-                margin: 8px 0;
-                border-radius: 4px;
-                cursor: grab;
-                transition: all 0.2s ease;
-            }
-            .feature-card:hover {
-                box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-                transform: translateX(3px);
-            }
-            .rank-instructions {
-                background-color: #f9f9f9;
-                padding: 15px;
-                border-radius: 5px;
-                margin: 20px 0;
-                text-align: left;
-                color: #2c3e50;
-            }
-            .rank-instructions p {
-                color: #2c3e50 !important;
-                margin-bottom: 10px;
-            }
-            .ranking-container {
-                margin: 20px 0;
-            }
-            </style>
-        """, unsafe_allow_html=True)
-        
+        # Clean, centered layout (styles come from static/app.css)
         st.markdown("<div class='session-complete'>", unsafe_allow_html=True)
         
         # Get all features from the session
@@ -647,7 +526,7 @@ def main():
             """, unsafe_allow_html=True)
             
             # Create a list of features for ranking
-            features = [prompt['prompt'] for prompt in st.session_state.story_manager.user_prompts]
+            features = [prompt.prompt for prompt in st.session_state.story_manager.user_prompts]
             
             # Use session state to maintain rankings between reruns
             if 'feature_rankings' not in st.session_state:
@@ -778,58 +657,42 @@ def main():
             st.session_state.story_manager = StoryManager()
             st.session_state.client = Swarm()
             st.session_state.agent_a, st.session_state.agent_b, st.session_state.agent_d, st.session_state.agent_intro = create_agents()
+            st.session_state.prefetcher = ChallengePrefetcher(st.session_state.client, st.session_state.agent_b)
             st.session_state.input_key = 0
             
             # Generate intro story
             if not st.session_state.get('intro_story_generated'):
-                # Show progress bar for intro story generation - simpler approach
-                st.markdown("<p style='text-align:center; color:#3498db;'>Creating your opening story...</p>", unsafe_allow_html=True)
-                progress_bar = st.progress(0)
-                
-                # Get random first dimension (25% progress)
+                # Get random first dimension
                 first_chapter = st.session_state.story_manager.get_random_uncovered_dimension()
                 first_dimension = st.session_state.story_manager.get_actual_dimension(first_chapter)
-                progress_bar.progress(25)
-                time.sleep(0.1)  # Brief pause between updates
                 
-                # Get dimension information from Agent B (50% progress)
-                response_b = st.session_state.client.run(
-                    agent=st.session_state.agent_b,  # Agent B
-                    messages=[{
-                        "role": "system",
-                        "content": f"""
-                            Selected Dimension: {first_dimension}
-                            Provide challenge information for creating an engaging story.
-                        """
-                    }]
-                )
-                progress_bar.progress(50)
-                time.sleep(0.1)  # Brief pause between updates
+                # Serve a pre-generated story from the shared pool when one is ready
+                intro = intro_pool.take(first_dimension)
                 
-                # Generate intro story with the challenge (75% progress)
-                response_intro = st.session_state.client.run(
-                    agent=st.session_state.agent_intro,  # Agent Intro (index 3 since we return intro_agent last)
-                    messages=[{
-                        "role": "system",
-                        "content": f"""
-                            Create an opening story that introduces social proxy robots.
-                            Use these challenges as inspiration for your story:
-                            {response_b.messages[-1]["content"]}
-                        """
-                    }]
-                )
-                progress_bar.progress(75)
-                time.sleep(0.1)  # Brief pause between updates
+                progress = None
+                if intro is None:
+                    # Pool is empty, so generate the story now - show progress bar
+                    st.markdown("<p style='text-align:center; color:#3498db;'>Creating your opening story...</p>", unsafe_allow_html=True)
+                    progress = ProgressDisplay(st)
+                    
+                    # Get dimension information (Agent B), then stream the intro story (Agent Intro)
+                    result = run_story_pipeline(
+                        build_intro_pipeline(st.session_state.agent_b, st.session_state.agent_intro, stream=True),
+                        {'dimension': first_dimension},
+                        progress
+                    )
+                    intro = {'story': parse_story(result['story']), 'challenge': result['challenge']}
                 
-                # Add the story and mark dimension as covered (100% progress)
-                if "STORY:" in response_intro.messages[-1]["content"]:
-                    story_text = response_intro.messages[-1]["content"].split("STORY:")[1].strip()
-                    st.session_state.story_manager.add_story_segment(f"STORY: {story_text}")
+                # Add the story and mark dimension as covered
+                if intro['story']:
+                    unsubscribe = st.session_state.story_manager.events.subscribe(progress.on_store_event) if progress else None
+                    st.session_state.story_manager.add_parameter(first_dimension)
+                    st.session_state.story_manager.add_challenge(intro['challenge'])
+                    st.session_state.story_manager.add_story_segment(f"STORY: {intro['story']}")
                     st.session_state.story_manager.add_covered_dimension(first_chapter)
                     st.session_state.intro_story_generated = True
-                
-                # Complete the progress bar
-                progress_bar.progress(100)
+                    if unsubscribe:
+                        unsubscribe()
             
             # Set started state and rerun
             st.session_state.started = True
@@ -845,201 +708,17 @@ def main():
         # Create two columns
         col1, col2 = st.columns([2, 1])
         
+        # Each panel is a fragment, so navigating, typing or toggling the
+        # history reruns only that panel instead of the whole app
         with col1:
-            # Chapter Navigation
-            nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
-            
-            # Get current chapter number and total chapters
-            current_chapter = len(st.session_state.story_manager.covered_dimensions)
-            total_chapters = len(st.session_state.story_manager.session_story)
-            viewing_chapter = st.session_state.get('viewing_chapter', current_chapter)
-            
-            with nav_col1:
-                if viewing_chapter > 1:  # Can go back if not at first chapter
-                    if st.button("←"):
-                        st.session_state.viewing_chapter = viewing_chapter - 1
-                        st.rerun()
-            
-            with nav_col2:
-                st.markdown(f"### Chapter {viewing_chapter}", unsafe_allow_html=True)
-            
-            with nav_col3:
-                if viewing_chapter < total_chapters:  # Can go forward if not at last chapter
-                    if st.button("→"):
-                        st.session_state.viewing_chapter = viewing_chapter + 1
-                        st.rerun()
-            
-            # Chapter Story Display
-            if viewing_chapter > 0 and viewing_chapter <= total_chapters:
-                story = st.session_state.story_manager.session_story[viewing_chapter - 1]['segment']
-                display_story_with_animation(story, st)
+            chapter_viewer()
             
             # Only show input section if we're on any chapter
-            if viewing_chapter > 0:
-                # Design input section
-                st.markdown("<div class='header-style'>Design Input</div>", unsafe_allow_html=True)
-                st.info(f"""
-                **Before adding feature to Chapter {viewing_chapter}, please consider the following:**
-                - How would you enhance the current functionality?
-                - Why do you think this feature is important?
+            if get_viewing_chapter() > 0:
+                design_input()
                 
-                
-                **Example format:**
-                - Add <FEATURE 1> because <REASON>
-                - Add <FEATURE 2> because <REASON> and so on...
-                
-                **Please add more than one feature in the dialog box below.**
-
-                """)
-                
-                # User input (without copy-paste warning)
-                user_input = st.text_area(
-                    "Enter your design idea:",
-                    key=f"user_input_{st.session_state.input_key}_{viewing_chapter}",
-                    height=100,
-                    placeholder="Describe your design idea here..."
-                )
-                
-                # Use Streamlit components.html for isolated JavaScript execution
-                disable_paste_js = """
-                <script>
-                window.addEventListener('load', function() {
-                    // Give Streamlit time to render
-                    setTimeout(function() {
-                        // Target only textareas
-                        var textareas = parent.document.querySelectorAll('textarea');
-                        textareas.forEach(function(textarea) {
-                            // Disable paste
-                            textarea.addEventListener('paste', function(e) {
-                                e.preventDefault();
-                                return false;
-                            });
-                            
-                            // Disable cut
-                            textarea.addEventListener('cut', function(e) {
-                                e.preventDefault();
-                                return false;
-                            });
-                            
-                            // Disable keyboard shortcuts for paste (Ctrl+V)
-                            textarea.addEventListener('keydown', function(e) {
-                                if (e.ctrlKey && (e.key === 'v' || e.keyCode === 86)) {
-                                    e.preventDefault();
-                                    return false;
-                                }
-                            });
-                            
-                            // Disable context menu to prevent paste that way
-                            textarea.addEventListener('contextmenu', function(e) {
-                                e.preventDefault();
-                                return false;
-                            });
-                        });
-                    }, 1000);
-                });
-                </script>
-                """
-                
-                # Use Streamlit's components.html for isolated JS execution
-                import streamlit.components.v1 as components
-                components.html(disable_paste_js, height=0)
-                
-                # Create columns for buttons - just one column for generate button
-                generate_col1, generate_col2 = st.columns([1, 2])
-                
-                with generate_col1:
-                    generate_button = st.button("🚀 Next Chapter", use_container_width=True)
-                
-                # Generate story logic here...
-                if generate_button and user_input:
-                    # Show progress bar with simpler implementation
-                    st.markdown("<p style='text-align:center; color:#3498db;'>Generating your story...</p>", unsafe_allow_html=True)
-                    progress_bar = st.progress(0)
-                    
-                    try:
-                        # Add user prompt (25% progress)
-                        st.session_state.story_manager.add_user_prompt(user_input)
-                        progress_bar.progress(25)
-                        time.sleep(0.1)  # Brief pause between updates
-                        
-                        # Use the dimension from the current viewing chapter
-                        current_dimension = st.session_state.story_manager.get_actual_dimension(f"Chapter {viewing_chapter}")
-                        
-                        # Get dimension information from Agent B (50% progress)
-                        response_b = st.session_state.client.run(
-                            agent=st.session_state.agent_b,
-                            messages=[{
-                                "role": "system",
-                                "content": f"""
-                                    Selected Dimension: {current_dimension}
-                                    Provide challenge information for creating an engaging story.
-                                """
-                            }]
-                        )
-                        progress_bar.progress(50)
-                        time.sleep(0.1)  # Brief pause between updates
-                        
-                        # Pass user input and dimension info to Agent D (75% progress)
-                        response_d = st.session_state.client.run(
-                            agent=st.session_state.agent_d,
-                            messages=[{
-                                "role": "system",
-                                "content": f"""
-                                    New Feature: {user_input}
-                                    
-                                    Use these challenges as inspiration for your story:
-                                    {response_b.messages[-1]["content"]}
-                                    
-                                """
-                            }]
-                        )
-                        progress_bar.progress(75)
-                        time.sleep(0.1)  # Brief pause between updates
-                        
-                        # Update story (100% progress)
-                        if "STORY:" in response_d.messages[-1]["content"]:
-                            story_text = response_d.messages[-1]["content"].split("STORY:")[1].strip()
-                            
-                            # If adding to a previous chapter, update that chapter's story
-                            if viewing_chapter < current_chapter:
-                                # Update the specific chapter's story
-                                st.session_state.story_manager.update_chapter_story(
-                                    viewing_chapter, 
-                                    f"STORY: {story_text}"
-                                )
-                                # Keep the user on the same chapter
-                                st.session_state.viewing_chapter = viewing_chapter
-                            else:
-                                # Adding to current chapter, create new chapter as before
-                                st.session_state.story_manager.current_story = story_text
-                                st.session_state.story_manager.add_story_segment(response_d.messages[-1]["content"])
-                                st.session_state.story_manager.add_covered_dimension(viewing_chapter)
-                                # Move to next chapter only when adding to current chapter
-                                st.session_state.viewing_chapter = len(st.session_state.story_manager.session_story)
-                            
-                            # Complete the progress bar
-                            progress_bar.progress(100)
-                            
-                            st.success("✨ Story generated successfully!")
-                            
-                            # Check if this was Chapter 6
-                            if viewing_chapter == 6:
-                                # End session automatically
-                                end_session()
-                                st.rerun()
-                        
-                        else:
-                            st.error(f"Failed to generate a valid story. Response received: {response_d.messages[-1]['content']}")
-                        
-                        # Force a rerun to update the display
-                        st.rerun()
-                        
-                        # Save session and increment input key
-                        st.session_state.story_manager.save_session()
-                        st.session_state.input_key += 1
-                        
-                    except Exception as e:
-                        st.error(f"Error generating story: {str(e)}")
+                if generation_key():
+                    generation_status()
 
             # Add divider after story generation
             st.markdown("""
@@ -1047,21 +726,7 @@ def main():
             """, unsafe_allow_html=True)
 
         with col2:
-            st.markdown("<div class='header-style'>Feature History</div>", unsafe_allow_html=True)
-            
-            show_history = st.toggle("Show Previous Features", value=True)
-            
-            if show_history and st.session_state.story_manager.user_prompts:
-                # Create a numbered list of all prompts
-                for i, prompt_data in enumerate(st.session_state.story_manager.user_prompts, 1):
-                    prompt = prompt_data['prompt']
-                    st.markdown(
-                        f"""<div class='feature-box'>
-                            <span class='feature-number'>#{i}</span>
-                            <div class='feature-text'>{prompt}</div>
-                        </div>""", 
-                        unsafe_allow_html=True
-                    )
+            feature_history()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
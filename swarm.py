@@ -1,18 +1,114 @@
+import asyncio
+import json
+import threading
+import time
+
+import httpx
 import streamlit as st
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from progress import ProgressEvent
+
+MODEL = "gpt-4-turbo-preview"
+
+# Streams report their running token count every this many content chunks
+TOKEN_EVENT_INTERVAL = 16
+
+class HandoffError(RuntimeError):
+    """Raised when an agent handoff exceeds the hop budget or loops back"""
 
 class Agent:
-    def __init__(self, name, instructions, functions=None):
+    def __init__(self, name, instructions, functions=None, knowledge=None):
         self.name = name
         self.instructions = instructions
         self.functions = functions or []
+        # Optional knowledge base keyed by topic; instructions mark where the
+        # selected entry goes with a {knowledge} placeholder
+        self.knowledge = knowledge or {}
+        self.system_prompts = self._assemble_system_prompts()
+        # Handoff functions are offered to the model as tools, looked up by name
+        self.function_map = {function.__name__: function for function in self.functions}
+        self.tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": function.__name__,
+                    "description": (function.__doc__ or function.__name__).strip(),
+                    "parameters": {"type": "object", "properties": {}}
+                }
+            }
+            for function in self.functions
+        ]
+    
+    def _assemble_system_prompts(self):
+        # Assemble every prompt variant once, so each call is just a lookup
+        if not self.knowledge:
+            return {None: f"You are {self.name}. {self.instructions}"}
+        prompts = {
+            key: f"You are {self.name}. " + self.instructions.replace("{knowledge}", text)
+            for key, text in self.knowledge.items()
+        }
+        # Without a key, fall back to the full knowledge base
+        prompts[None] = f"You are {self.name}. " + self.instructions.replace("{knowledge}", "\n".join(self.knowledge.values()))
+        return prompts
+    
+    def system_prompt(self, knowledge_key=None):
+        """Get the system prompt carrying only the selected knowledge entry"""
+        return self.system_prompts.get(knowledge_key, self.system_prompts[None])
 
-class Swarm:
+def _pool_limits():
+    # All requests go to the same API host, so the pool limits below are
+    # effectively per-host limits. Keep-alive connections stay warm between
+    # sessions instead of each visitor paying TCP/TLS setup again.
+    return httpx.Limits(
+        max_connections=int(st.secrets.get("openai_max_connections", 100)),
+        max_keepalive_connections=int(st.secrets.get("openai_max_keepalive_connections", 20)),
+        keepalive_expiry=float(st.secrets.get("openai_keepalive_expiry", 60.0)),
+    )
+
+def _pool_timeout():
+    return httpx.Timeout(float(st.secrets.get("openai_timeout", 60.0)), connect=10.0)
+
+@st.cache_resource
+def get_openai_client():
+    """Create the process-wide OpenAI client shared by every session"""
+    http_client = httpx.Client(limits=_pool_limits(), timeout=_pool_timeout())
+    return OpenAI(api_key=st.secrets["OPENAI_API_KEY"], http_client=http_client)
+
+class AsyncRuntime:
+    """Background event loop that owns the process-wide AsyncOpenAI client.
+    
+    Streamlit scripts are synchronous, and an async HTTP pool is bound to the
+    loop it was first used on, so every async call is scheduled onto this one
+    long-lived loop instead of a fresh asyncio.run() per call.
+    """
+    
     def __init__(self):
-        # Use Streamlit secrets for OpenAI API key
-        self.client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="swarm-async", daemon=True)
+        self._thread.start()
+        http_client = httpx.AsyncClient(limits=_pool_limits(), timeout=_pool_timeout())
+        self.client = AsyncOpenAI(api_key=st.secrets["OPENAI_API_KEY"], http_client=http_client)
+    
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+@st.cache_resource
+def get_async_runtime():
+    """Get the process-wide async runtime shared by every session"""
+    return AsyncRuntime()
+
+class Swarm:
+    def __init__(self, client=None, runtime=None, max_hops=None, run_timeout=None):
+        # Borrow the shared clients so every session reuses the same connection pools
+        self.client = client or get_openai_client()
+        self.runtime = runtime or get_async_runtime()
+        # Bound every run, however many agents it hands off between
+        self.max_hops = max_hops if max_hops is not None else int(st.secrets.get("agent_max_hops", 3))
+        self.run_timeout = run_timeout or float(st.secrets.get("agent_run_timeout", 120))
         
-    def run(self, agent, messages):
+    def _build_messages(self, agent, messages, knowledge_key=None):
         # Prepare the conversation
         conversation = []
         for msg in messages:
@@ -22,20 +118,148 @@ class Swarm:
             })
         
         # Add agent instructions
-        system_message = f"You are {agent.name}. {agent.instructions}"
-        
-        # Make the API call
-        response = self.client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": system_message},
-                *conversation
-            ]
+        system_message = agent.system_prompt(knowledge_key)
+        return [{"role": "system", "content": system_message}, *conversation]
+    
+    def _request(self, agent, history, knowledge_key, deadline, handoffs):
+        # Give each hop only the time left before the run's deadline
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Agent run exceeded its {self.run_timeout}s deadline at {agent.name}")
+        request = {
+            "model": MODEL,
+            "messages": self._build_messages(agent, history, knowledge_key),
+            "timeout": remaining
+        }
+        if handoffs and agent.tools:
+            request["tools"] = agent.tools
+        return request
+    
+    @staticmethod
+    def _report(on_progress, kind, agent, **data):
+        if on_progress:
+            on_progress(ProgressEvent(kind, agent.name, data))
+    
+    def _report_response(self, on_progress, agent, response, started):
+        usage = getattr(response, 'usage', None)
+        self._report(
+            on_progress, 'response_received', agent,
+            tokens=usage.completion_tokens if usage else None,
+            elapsed=time.monotonic() - started
+        )
+    
+    def _report_chunk(self, on_progress, agent, count, started):
+        if count == 1:
+            self._report(on_progress, 'first_token', agent, latency=time.monotonic() - started)
+        if count % TOKEN_EVENT_INTERVAL == 0:
+            self._report(on_progress, 'tokens', agent, count=count)
+    
+    def _handoff(self, agent, message, history, visited):
+        """Record the agent's reply and return the agent it hands off to, or None when done"""
+        if not message.tool_calls:
+            history.append({"role": "assistant", "content": message.content or ""})
+            return None
+        if message.content:
+            history.append({"role": "assistant", "content": message.content})
+        
+        # Only real tool calls mapped to the agent's functions hand off
+        call = message.tool_calls[0]
+        function = agent.function_map.get(call.function.name)
+        if function is None:
+            raise HandoffError(f"{agent.name} called unknown function {call.function.name}")
+        next_agent = function(**json.loads(call.function.arguments or "{}"))
+        if len(visited) > self.max_hops:
+            raise HandoffError(f"Handoff budget of {self.max_hops} hops exceeded: {' -> '.join(visited)}")
+        if next_agent.name in visited:
+            raise HandoffError(f"Handoff loop detected: {' -> '.join(visited)} -> {next_agent.name}")
+        visited.append(next_agent.name)
+        return next_agent
+    
+    def run(self, agent, messages, knowledge_key=None, handoffs=True, on_progress=None):
+        """Run the agent, following handoffs; `on_progress(event)` receives a ProgressEvent per request and reply"""
+        # One history buffer is shared by every hop instead of being copied per handoff
+        history = list(messages)
+        visited = [agent.name]
+        deadline = time.monotonic() + self.run_timeout
+        
+        while agent is not None:
+            request = self._request(agent, history, knowledge_key, deadline, handoffs)
+            started = time.monotonic()
+            self._report(on_progress, 'request_sent', agent, hop=len(visited))
+            response = self.client.chat.completions.create(**request)
+            self._report_response(on_progress, agent, response, started)
+            agent = self._handoff(agent, response.choices[0].message, history, visited)
+        
+        return type('Response', (), {'messages': history})
+    
+    def stream(self, agent, messages, knowledge_key=None, on_progress=None):
+        """Stream the agent's reply, yielding content deltas as they arrive.
+        
+        Streaming talks to a single agent and offers it no tools; handoffs go through run().
+        """
+        started = time.monotonic()
+        self._report(on_progress, 'request_sent', agent, hop=1)
+        stream = self.client.chat.completions.create(
+            model=MODEL,
+            messages=self._build_messages(agent, messages, knowledge_key),
+            stream=True
+        )
+        count = 0
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                count += 1
+                self._report_chunk(on_progress, agent, count, started)
+                yield chunk.choices[0].delta.content
+        self._report(on_progress, 'response_received', agent, tokens=count, elapsed=time.monotonic() - started)
+    
+    async def arun(self, agent, messages, knowledge_key=None, handoffs=True, on_progress=None):
+        """Async counterpart of run() on the shared AsyncOpenAI client"""
+        history = list(messages)
+        visited = [agent.name]
+        deadline = time.monotonic() + self.run_timeout
+        
+        while agent is not None:
+            request = self._request(agent, history, knowledge_key, deadline, handoffs)
+            started = time.monotonic()
+            self._report(on_progress, 'request_sent', agent, hop=len(visited))
+            response = await self.runtime.client.chat.completions.create(**request)
+            self._report_response(on_progress, agent, response, started)
+            agent = self._handoff(agent, response.choices[0].message, history, visited)
+        
+        return type('Response', (), {'messages': history})
+    
+    async def astream(self, agent, messages, knowledge_key=None, on_progress=None):
+        """Async counterpart of stream(), yielding content deltas as they arrive"""
+        started = time.monotonic()
+        self._report(on_progress, 'request_sent', agent, hop=1)
+        stream = await self.runtime.client.chat.completions.create(
+            model=MODEL,
+            messages=self._build_messages(agent, messages, knowledge_key),
+            stream=True
         )
+        count = 0
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                count += 1
+                self._report_chunk(on_progress, agent, count, started)
+                yield chunk.choices[0].delta.content
+        self._report(on_progress, 'response_received', agent, tokens=count, elapsed=time.monotonic() - started)
+    
+    async def gather(self, calls, timeout=None):
+        """Run independent agent calls concurrently.
         
-        # Check if we should transfer to another agent
-        if agent.functions and response.choices[0].message.content.lower().find("transfer") != -1:
-            next_agent = agent.functions[0]()
-            return self.run(next_agent, messages + [{"role": "assistant", "content": response.choices[0].message.content}])
+        `calls` maps a name to the keyword arguments for arun(), plus an
+        optional per-call `timeout` overriding the default. Returns a dict with
+        the same names holding either the response or the exception (including
+        asyncio.TimeoutError) raised by that call.
+        """
+        async def run_one(timeout=timeout, **kwargs):
+            return await asyncio.wait_for(self.arun(**kwargs), timeout)
         
-        return type('Response', (), {'messages': messages + [{"role": "assistant", "content": response.choices[0].message.content}]}) 
\ No newline at end of file
+        names = list(calls)
+        results = await asyncio.gather(*(run_one(**calls[name]) for name in names), return_exceptions=True)
+        return dict(zip(names, results))
+    
+    def run_concurrently(self, calls, timeout=None):
+        """Blocking wrapper around gather() for use from the Streamlit script thread"""
+        return self.runtime.submit(self.gather(calls, timeout=timeout)).result()
@@ -0,0 +1,168 @@
+import threading
+import time
+import uuid
+
+import streamlit as st
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from db import get_database
+from journal import Journal
+
+class WriteTicket:
+    """Acknowledgement handle for one queued write"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.error = None
+
+    def resolve(self, error=None):
+        self.error = error
+        self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def ok(self):
+        return self.done and self.error is None
+
+    def wait(self, timeout=None):
+        """Wait for the write to reach MongoDB; True if it was acknowledged"""
+        return self._done.wait(timeout) and self.error is None
+
+class WriteBehindQueue:
+    """Journal-backed queue of MongoDB writes replayed by one background thread.
+
+    `insert()`/`update()` only append to the local journal, so they never wait
+    on the network, and return a ticket that resolves once MongoDB has
+    acknowledged the write. The replayer drains the journal in order with one
+    ordered `bulk_write` per run of same-collection operations. If MongoDB is
+    slow or unreachable, operations stay journaled (surviving restarts) and
+    are retried. Inserts carry a client-generated `_id` and are applied as
+    `$setOnInsert` upserts on it, so replaying a write twice is harmless.
+    """
+
+    def __init__(self, db, journal, batch_size=200, retry_delay=5):
+        self.db = db
+        self.journal = journal
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self._tickets = {}  # journal id -> WriteTicket
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = threading.Thread(target=self._replay_forever, name="mongo-journal-replayer", daemon=True)
+        self._worker.start()
+
+    def insert(self, collection, document):
+        """Journal an insert; the generated `_id` doubles as its dedup key"""
+        return self._submit(collection, {'kind': 'insert', 'document': {'_id': uuid.uuid4().hex, **document}})
+
+    def update(self, collection, filter, update, upsert=False, many=False):
+        """Journal an update (or pipeline update); it must be safe to apply more than once"""
+        return self._submit(collection, {
+            'kind': 'update', 'filter': filter, 'update': update, 'upsert': upsert, 'many': many
+        })
+
+    def _submit(self, collection, operation):
+        ticket = WriteTicket()
+        with self._lock:
+            self._tickets[self.journal.append(collection, operation)] = ticket
+        self._wakeup.set()
+        return ticket
+
+    @property
+    def pending(self):
+        return self.journal.backlog()
+
+    def _resolve(self, row_id, error=None):
+        with self._lock:
+            ticket = self._tickets.pop(row_id, None)
+        # Rows journaled by an earlier process have no ticket waiting on them
+        if ticket is not None:
+            ticket.resolve(error)
+
+    def _replay_forever(self):
+        while True:
+            try:
+                self._replay_batch()
+            except Exception as e:
+                # Never let a journal or driver error kill the replayer; the rows stay journaled
+                print(f"Journal replayer error, retrying: {e!r}")
+                time.sleep(self.retry_delay)
+
+    def _replay_batch(self):
+        rows = self.journal.pending(self.batch_size)
+        if not rows:
+            self._wakeup.wait(self.retry_delay)
+            self._wakeup.clear()
+            return
+        
+        # Split into runs of the same collection, keeping journal order
+        runs = []
+        for row in rows:
+            if runs and runs[-1][0][1] == row[1]:
+                runs[-1].append(row)
+            else:
+                runs.append([row])
+        for run in runs:
+            applied = self._apply(run[0][1], run)
+            if applied is False:
+                # MongoDB is unavailable; leave the rest journaled and retry later
+                time.sleep(self.retry_delay)
+            if not applied:
+                # Re-read the journal so nothing is applied out of order
+                break
+
+    def _apply(self, collection, rows):
+        """Apply a run of operations: True if all applied, None if one was rejected, False if unreachable"""
+        operations = []
+        for _, _, operation in rows:
+            if operation['kind'] == 'insert':
+                document = operation['document']
+                operations.append(UpdateOne({'_id': document['_id']}, {'$setOnInsert': document}, upsert=True))
+            else:
+                # Rows journaled before upsert/many existed default to a plain update_one
+                write = UpdateMany if operation.get('many') else UpdateOne
+                operations.append(write(operation['filter'], operation['update'], upsert=operation.get('upsert', False)))
+        
+        try:
+            self.db[collection].bulk_write(operations, ordered=True)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors') or []
+            if not write_errors:
+                # Only the write concern failed; replaying is safe since every
+                # journaled operation is idempotent
+                print(f"Journal replay to {collection} hit a write concern error, will retry: {str(e)}")
+                return False
+            # Ordered writes stop at the first error: everything before it was
+            # applied, the failing one is rejected for good, the rest is replayed
+            error = write_errors[0]
+            applied = [row_id for row_id, _, _ in rows[:error['index']]]
+            self.journal.mark_applied(applied)
+            for row_id in applied:
+                self._resolve(row_id)
+            failed_id = rows[error['index']][0]
+            self.journal.mark_failed(failed_id, error.get('errmsg', str(e)))
+            self._resolve(failed_id, error.get('errmsg', str(e)))
+            return None
+        except Exception as e:
+            print(f"Journal replay to {collection} failed, will retry: {str(e)}")
+            return False
+        
+        applied = [row_id for row_id, _, _ in rows]
+        self.journal.mark_applied(applied)
+        for row_id in applied:
+            self._resolve(row_id)
+        return True
+
+@st.cache_resource
+def get_write_queue():
+    """Get the process-wide journal-backed write queue shared by every session"""
+    return WriteBehindQueue(
+        get_database(),
+        Journal(st.secrets.get("journal_path", "data/write_journal.sqlite3")),
+        batch_size=int(st.secrets.get("write_queue_batch_size", 200)),
+        retry_delay=float(st.secrets.get("journal_retry_delay", 5)),
+    )